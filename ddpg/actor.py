@@ -8,6 +8,7 @@ from keras.optimizers import Adam
 import tensorflow as tf
 import keras.backend as K
 import os
+from numpyNetwork import save_network
 
 class ActorNetwork(object):
     def __init__(self, sess, state_size, action_size, action_bound, tau, learning_rate):
@@ -29,11 +30,22 @@ class ActorNetwork(object):
         self.out = self.model.output
         self.params_grad = tf.gradients(self.out, self.weights, -self.action_gradient)
         grads = zip(self.params_grad, self.weights)
-        self.optimize = tf.train.AdamOptimizer(learning_rate).apply_gradients(grads)
+        self.optimizer = tf.train.AdamOptimizer(learning_rate)
+        self.optimize = self.optimizer.apply_gradients(grads)
 
         self.stat_ops += [tf.reduce_mean(self.out)]
         self.stat_names += ["Mean action"]
 
+        # Single state action path: prebuilt callables fed from a preallocated batch of one
+        self.act_state = np.zeros((1, state_size), dtype='float32')
+        self.act_callable = self.sess.make_callable(self.out, [self.state])
+        self.act_target_callable = self.sess.make_callable(self.target_model.output, [self.target_state])
+
+        self.soft_update_ops = self.build_target_update(tau)
+        self.hard_update_ops = self.build_target_update(1.)
+        self.soft_update = tf.group(*self.soft_update_ops)
+        self.hard_update = tf.group(*self.hard_update_ops)
+
         self.sess.run(tf.global_variables_initializer())
 
     def train(self, states, action_grads):
@@ -42,18 +54,42 @@ class ActorNetwork(object):
             self.action_gradient: action_grads
         })
 
+    def chain_critic(self, critic):
+        """Feed the actor output to the critic model (sharing its weights), so that
+        train_chained does the policy gradient step from the states alone"""
+        self.chained_q = critic.model([self.state, self.out])
+        # Same gradient as train with the critic's dQ/da, and the same Adam state
+        self.chained_optimize = self.optimizer.minimize(-tf.reduce_sum(self.chained_q), var_list=self.weights)
+
+    def train_chained(self, states, fetches=(), feed_dict=None):
+        """Policy gradient step, fetching the extra tensors fetches in the same run"""
+        feed_dict = dict(feed_dict or {})
+        feed_dict[self.state] = states
+        return self.sess.run([self.chained_optimize] + list(fetches), feed_dict=feed_dict)[1:]
+
     def predict_target(self, states):
         return self.target_model.predict_on_batch(states)
 
     def predict(self, states):
         return self.model.predict_on_batch(states)
 
+    def act(self, state):
+        """Same as predict on a single state, returns a (1, action_size) array"""
+        self.act_state[0] = state
+        return self.act_callable(self.act_state)
+
+    def act_target(self, state):
+        """Same as predict_target on a single state, returns a (1, action_size) array"""
+        self.act_state[0] = state
+        return self.act_target_callable(self.act_state)
+
+    def build_target_update(self, tau):
+        """Assign ops moving the target weights towards the weights by a fraction tau (1 for a copy)"""
+        return [tf.assign(target_weight, tau * weight + (1 - tau) * target_weight)
+                for weight, target_weight in zip(self.model.weights, self.target_model.weights)]
+
     def target_train(self):
-        actor_weights = self.model.get_weights()
-        actor_target_weights = self.target_model.get_weights()
-        for i in range(len(actor_weights)):
-            actor_target_weights[i] = self.tau * actor_weights[i] + (1 - self.tau)* actor_target_weights[i]
-        self.target_model.set_weights(actor_target_weights)
+        self.sess.run(self.soft_update)
 
     def create_actor_network(self, state_size,action_dim):
         S = Input(shape=[state_size])
@@ -76,7 +112,15 @@ class ActorNetwork(object):
         return stats
 
     def hard_target_update(self):
-        self.target_model.set_weights(self.model.get_weights())
+        self.sess.run(self.hard_update)
+
+    def export(self, filepath, target=False):
+        """Write the weights and layer spec of the (target) actor to an .npz file that
+        NumpyNetwork evaluates without tensorflow"""
+        model = self.target_model if target else self.model
+        layers = [({'type': 'dense', 'activation': layer.get_config()['activation']}, layer.get_weights())
+                  for layer in model.layers if isinstance(layer, Dense)]
+        save_network(filepath, ['state'], layers)
 
     def save_weights(self, filepath, overwrite=False):
         print("Saving weights")
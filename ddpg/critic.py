@@ -4,12 +4,13 @@ from keras.initializers import RandomUniform
 from keras.models import model_from_json
 from keras.models import Sequential
 from keras.layers import Dense, Flatten, Input, Lambda, Activation
-from keras.layers.merge import concatenate
+from keras.layers.merge import concatenate, Concatenate
 from keras.models import Sequential, Model
 from keras.optimizers import Adam
 import keras.backend as K
 import tensorflow as tf
 import os
+from numpyNetwork import save_network
 
 HIDDEN1_UNITS = 100
 HIDDEN2_UNITS = 100
@@ -42,6 +43,11 @@ class CriticNetwork(object):
         self.stat_ops += [tf.reduce_mean(self.action_grads)]
         self.stat_names += ['reference_action_grads']
 
+        self.soft_update_ops = self.build_target_update(tau)
+        self.hard_update_ops = self.build_target_update(1.)
+        self.soft_update = tf.group(*self.soft_update_ops)
+        self.hard_update = tf.group(*self.hard_update_ops)
+
         #TODO: fix by using a local initalizer
         self.sess.run(tf.global_variables_initializer())
 
@@ -55,15 +61,21 @@ class CriticNetwork(object):
         # TODO: clipping target critic values to [-10, 100] (max possible values)
         return self.target_model.predict_on_batch([states, actions])
 
-    def train(self, states, actions, targets):
-        return self.model.train_on_batch([states, actions], targets)
+    def predict(self, states, actions):
+        return self.model.predict_on_batch([states, actions])
+
+    def train(self, states, actions, targets, weights=None):
+        if weights is not None:
+            weights = np.ravel(weights)
+        return self.model.train_on_batch([states, actions], targets, sample_weight=weights)
+
+    def build_target_update(self, tau):
+        """Assign ops moving the target weights towards the weights by a fraction tau (1 for a copy)"""
+        return [tf.assign(target_weight, tau * weight + (1 - tau) * target_weight)
+                for weight, target_weight in zip(self.model.weights, self.target_model.weights)]
 
     def target_train(self):
-        critic_weights = self.model.get_weights()
-        critic_target_weights = self.target_model.get_weights()
-        for i in range(len(critic_weights)):
-            critic_target_weights[i] = self.tau * critic_weights[i] + (1 - self.tau) * critic_target_weights[i]
-        self.target_model.set_weights(critic_target_weights)
+        self.sess.run(self.soft_update)
 
     def create_critic_network(self, state_size, action_dim):
         S = Input(shape=[state_size])
@@ -99,6 +111,18 @@ class CriticNetwork(object):
 
         return stats
 
+    def export(self, filepath, target=False):
+        """Write the weights and layer spec of the (target) critic to an .npz file that
+        NumpyNetwork evaluates without tensorflow"""
+        model = self.target_model if target else self.model
+        layers = []
+        for layer in model.layers:
+            if isinstance(layer, Dense):
+                layers.append(({'type': 'dense', 'activation': layer.get_config()['activation']}, layer.get_weights()))
+            elif isinstance(layer, Concatenate):
+                layers.append(({'type': 'concat', 'input': 'action'}, []))
+        save_network(filepath, ['state', 'action'], layers)
+
     def save_weights(self, filepath, overwrite=False):
         print("Saving weights")
         self.model.save_weights(filepath, overwrite=overwrite)
@@ -114,4 +138,4 @@ class CriticNetwork(object):
         self.target_model.load_weights(filepath)
 
     def hard_target_update(self):
-        self.target_model.set_weights(self.model.get_weights())
\ No newline at end of file
+        self.sess.run(self.hard_update)
\ No newline at end of file
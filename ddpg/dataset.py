@@ -0,0 +1,83 @@
+import numpy as np
+import os
+import glob
+
+
+def dataset_dtype(env_wrapper):
+    """Row dtype of the dataset shards"""
+    return np.dtype([('state0', 'float32', env_wrapper.state_shape),
+                     ('action', 'float32', env_wrapper.action_shape),
+                     ('reward', 'float32', env_wrapper.reward_shape),
+                     ('state1', 'float32', env_wrapper.state_shape),
+                     ('terminal1', 'float32', env_wrapper.terminal_shape),
+                     ('episode', 'int64'),
+                     ('goal', 'float32', np.shape(env_wrapper.sample_initial_goal()))])
+
+
+class DatasetWriter(object):
+    def __init__(self, directory, env_wrapper, shard_size=100000):
+        """Streams the collected transitions to directory, as .npy shards of shard_size transitions
+        that OfflineMemory reads back through memory maps"""
+        self.directory = directory
+        self.shard_size = shard_size
+        self.rows = np.zeros(shard_size, dtype=dataset_dtype(env_wrapper))
+        self.length = 0
+        self.nb_shards = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, buffer_item, episode, goal):
+        row = self.rows[self.length]
+        for name in ['state0', 'action', 'reward', 'state1', 'terminal1']:
+            row[name] = np.reshape(buffer_item[name], self.rows.dtype[name].shape)
+        row['episode'] = episode
+        row['goal'] = np.reshape(goal, self.rows.dtype['goal'].shape)
+        self.length += 1
+        if self.length == self.shard_size:
+            self.write_shard()
+
+    def write_shard(self):
+        if self.length == 0:
+            return
+        np.save(os.path.join(self.directory, 'shard_%05d.npy' % self.nb_shards), self.rows[:self.length])
+        self.nb_shards += 1
+        self.length = 0
+
+    def close(self):
+        """Write the last, incomplete shard"""
+        self.write_shard()
+
+
+class OfflineMemory(object):
+    def __init__(self, directory):
+        """Read-only replay buffer sampling uniformly from the shards written by DatasetWriter"""
+        self.shards = [np.load(file, mmap_mode='r')
+                       for file in sorted(glob.glob(os.path.join(directory, 'shard_*.npy')))]
+        assert self.shards, "no shard found in {}".format(directory)
+        self.ends = np.cumsum([len(shard) for shard in self.shards])
+        self.dtype = self.shards[0].dtype
+
+    @property
+    def nb_entries(self):
+        return int(self.ends[-1])
+
+    def size(self):
+        return self.nb_entries
+
+    def memory_usage(self):
+        """Bytes of the shards, which stay on disk and are paged in on demand"""
+        return {'shards': int(sum(shard.nbytes for shard in self.shards))}
+
+    def sample(self, batch_size):
+        idxs = np.random.randint(self.nb_entries, size=batch_size)
+        shard_idxs = np.searchsorted(self.ends, idxs, side='right')
+        batch = np.empty(batch_size, dtype=self.dtype)
+        for shard_idx in np.unique(shard_idxs):
+            rows = shard_idxs == shard_idx
+            batch[rows] = self.shards[shard_idx][idxs[rows] - (self.ends[shard_idx] - len(self.shards[shard_idx]))]
+        return {name: batch[name] for name in self.dtype.names}
+
+    def append(self, buffer_item, training=True):
+        pass
+
+    def flush(self):
+        pass
@@ -25,7 +25,14 @@ class DDPG_agent():
                  eval_episodes,
                  max_episode_steps,
                  max_steps,
-                 eval_freq):
+                 eval_freq,
+                 checkpoint_dir=None,
+                 checkpoint_freq=0,
+                 dataset_writer=None,
+                 fused_update=None,
+                 target_update='soft',
+                 target_update_freq=1,
+                 stats_freq=1):
 
         #portrait_actor(actor.target_model, test_env, save_figure=True, figure_file="saved_actor_const.png")
         self.sess = sess
@@ -34,6 +41,16 @@ class DDPG_agent():
         self.max_episode_steps = max_episode_steps
         self.max_steps = max_steps
         self.eval_freq = eval_freq
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_freq = checkpoint_freq
+        self.dataset_writer = dataset_writer
+        self.fused_update = fused_update
+        self.target_update = target_update
+        self.target_update_freq = target_update_freq
+        self.stats_freq = stats_freq
+        # Running sums of the network statistics since they were last logged
+        self.stats_sums = {}
+        self.stats_count = 0
 
         self.logger_step = logger_step
         self.logger_episode = logger_episode
@@ -43,6 +60,10 @@ class DDPG_agent():
         self.actor = actor
         self.actor_noise = actor_noise
         self.critic = critic
+        self.actor.chain_critic(critic)
+        # Both target networks are updated with a single run
+        self.soft_target_update = tf.group(actor.soft_update, critic.soft_update)
+        self.hard_target_update = tf.group(actor.hard_update, critic.hard_update)
         self.train_env = train_env
         self.test_env = test_env
 
@@ -62,9 +83,12 @@ class DDPG_agent():
 
     def train_critic(self, samples):
 
-        # Calculate targets
-        target_q = self.critic.predict_target(
-            samples['state1'], self.actor.predict_target(samples['state1']))
+        # Calculate targets, the target actions may have been prepared by the prefetcher
+        if 'target_action' in samples:
+            target_action = samples['target_action']
+        else:
+            target_action = self.actor.predict_target(samples['state1'])
+        target_q = self.critic.predict_target(samples['state1'], target_action)
 
         y_i = []
         for k in range(self.batch_size):
@@ -73,21 +97,55 @@ class DDPG_agent():
             else:
                 y_i.append(samples['reward'][k] + self.critic.gamma * target_q[k])
 
+        y_i = np.reshape(y_i, (self.batch_size, 1))
+
+        # Prioritized replay: refresh the priorities with the TD errors
+        if 'slots' in samples:
+            td_errors = y_i - self.critic.predict(samples['state0'], samples['action'])
+            self.memory.update_priorities(samples['slots'], td_errors)
+
+        # Non-uniform sampling: correct the loss with the importance sampling weights
+        weights = samples.get('weights')
+
         # Update the critic given the targets
         critic_loss = self.critic.train(
-            samples['state0'], samples['action'], np.reshape(y_i, (self.batch_size, 1)))
+            samples['state0'], samples['action'], y_i, weights)
         self.step_stats['Critic loss'] = critic_loss
 
     def train_actor(self, samples):
 
-        a_outs = self.actor.predict(samples['state0'])
         # TODO : experiment with inverted gradients
-        grads = self.critic.gradients(samples['state0'], a_outs)
-        self.actor.train(samples['state0'], grads)
+        if not self.stats_freq:
+            self.actor.train_chained(samples['state0'])
+            return
+
+        # The statistics of both networks are fetched by the same run
+        values = self.actor.train_chained(samples['state0'],
+                                          fetches=self.actor.stat_ops + self.critic.stat_ops,
+                                          feed_dict={self.critic.state: samples['state0'],
+                                                     self.critic.action: samples['action']})
+        self.accumulate_stats(dict(zip(self.actor.stat_names + self.critic.stat_names, values)))
+
+    def accumulate_stats(self, stats):
+        for key, value in stats.items():
+            self.stats_sums[key] = self.stats_sums.get(key, 0) + value
+        self.stats_count += 1
+
+    def log_stats(self):
+        """Every stats_freq steps, log the means of the accumulated statistics with the step stats,
+        they are not kept in step_stats so that each mean is written by a single dump"""
+        if not self.stats_count or self.train_step % self.stats_freq != 0:
+            return
+        for key in sorted(self.stats_sums.keys()):
+            self.logger_step.logkv(key, self.stats_sums[key] / self.stats_count)
+        self.stats_sums = {}
+        self.stats_count = 0
 
     def update_targets(self):
-        self.actor.target_train()
-        self.critic.target_train()
+        if self.target_update == 'soft':
+            self.sess.run(self.soft_target_update)
+        elif self.train_step % self.target_update_freq == 0:
+            self.sess.run(self.hard_target_update)
 
     def save_weights(self, filepath, overwrite=False):
         self.actor.save_weights(filepath, overwrite=overwrite)
@@ -100,34 +158,73 @@ class DDPG_agent():
 
 
     def step(self, observation, goal, k=0, test=True):
+        if hasattr(self.test_env if test else self.train_env, 'nb_envs'):
+            return self.step_batch(observation, goal, test)
         state0 = self.env_wrapper.process_observation(observation, goal)
         if test:
             #fig_name = "saved_actor_{}.png".format(k)
             #portrait_actor(self.actor.target_model, self.test_env, save_figure=True, figure_file=fig_name)
-            action = self.actor.target_model.predict(np.reshape(state0, (1, self.actor.s_dim)))
+            action = self.actor.act_target(state0)
             obs1, reward_env, done_env, info = self.test_env.step(action[0])
         else:
-            action = self.actor.model.predict(np.reshape(state0, (1, self.actor.s_dim)))
+            action = self.actor.act(state0)
             action += self.actor_noise()
-            action = np.clip(action, -self.actor.action_bound, self.actor.action_bound)
+            np.clip(action, -self.actor.action_bound, self.actor.action_bound, out=action)
             obs1, reward_env, done_env, info = self.train_env.step(action[0])
         sample = self.env_wrapper.process_step(state0, goal, action, obs1, reward_env, done_env, info)
         return obs1, sample
 
-    def train(self):
-        samples_train = self.memory.sample(self.batch_size)
-        self.train_critic(samples_train)
-        self.train_actor(samples_train)
-        self.update_targets()
-
-        actor_stats = self.actor.get_stats(samples_train)
-        for key in sorted(actor_stats.keys()):
-            self.step_stats[key] = (actor_stats[key])
-        critic_stats = self.critic.get_stats(samples_train)
-        for key in sorted(critic_stats.keys()):
-            self.step_stats[key] = (critic_stats[key])
+    def act_batch(self, observations, goals, test=True):
+        """Actions of the target actor (test) or of the noisy actor for N observations at once"""
+        states0 = self.env_wrapper.process_observations(observations, goals)
+        if test:
+            actions = self.actor.target_model.predict_on_batch(states0)
+        else:
+            actions = self.actor.model.predict_on_batch(states0)
+            actions += self.actor_noise()
+            actions = np.clip(actions, -self.actor.action_bound, self.actor.action_bound)
+        return states0, actions
+
+    def step_batch(self, observations, goals, test=True):
+        """Batch version of step, for environments holding N instances stepped together"""
+        env = self.test_env if test else self.train_env
+        states0, actions = self.act_batch(observations, goals, test)
+        obs1, rewards_env, dones_env, infos = env.step(actions)
+        samples = self.env_wrapper.process_steps(states0, goals, actions, obs1, rewards_env, dones_env, infos)
+        return obs1, samples
+
+    def sample_goal(self, observation):
+        """Goal of the next training episode, starting from observation"""
+        return self.env_wrapper.sample_goals(np.reshape(observation, (1, -1)), self.nb_goals_reached, 1)[0]
+
+    def train(self, nb_updates=1):
+        """Do nb_updates minibatch updates, the statistics are logged once for the step"""
+        for k in range(nb_updates):
+            samples_train = self.memory.sample(self.batch_size)
+            if self.fused_update is not None:
+                self.train_fused(samples_train)
+                continue
+            self.train_critic(samples_train)
+            self.train_actor(samples_train)
+            self.update_targets()
+        self.log_stats()
+
+    def train_fused(self, samples):
+        results = self.fused_update.train(samples, with_stats=bool(self.stats_freq))
+        td_errors = results.pop('td_errors')
+        if 'slots' in samples:
+            self.memory.update_priorities(samples['slots'], td_errors)
+        if self.target_update != 'soft':
+            self.update_targets()
+        self.step_stats['Critic loss'] = results.pop('Critic loss')
+        if self.stats_freq:
+            self.accumulate_stats(results)
 
     def test(self):
+        if hasattr(self.test_env, 'nb_envs'):
+            self.test_batch()
+            return
+
         test_rewards = []
 
         for episode in range(self.eval_episodes):
@@ -170,6 +267,30 @@ class DDPG_agent():
 
         self.step_stats['Test reward on random goal'] = np.mean(test_rewards)
 
+    def test_episodes(self, sample_goals):
+        """Returns the rewards of eval_episodes test episodes, played nb_envs at a time"""
+        test_rewards = []
+        while len(test_rewards) < self.eval_episodes:
+            test_obs = self.test_env.reset()
+            self.test_goal = sample_goals(test_obs)
+            ep_test_rewards = np.zeros(self.test_env.nb_envs)
+            running = np.ones(self.test_env.nb_envs, dtype=bool)
+            for k in range(self.max_episode_steps):
+                test_obs, test_samples = self.step_batch(test_obs, self.test_goal, test=True)
+                ep_test_rewards += running * test_samples['reward']
+                running &= ~test_samples['terminal1']
+                if not np.any(running):
+                    break
+            test_rewards.extend(ep_test_rewards)
+        return test_rewards[:self.eval_episodes]
+
+    def test_batch(self):
+        test_rewards = self.test_episodes(lambda obs: np.tile(self.env_wrapper.sample_initial_goal(), (len(obs), 1)))
+        self.step_stats['Test reward on initial goal'] = np.mean(test_rewards)
+
+        test_rewards = self.test_episodes(self.env_wrapper.sample_random_goals)
+        self.step_stats['Test reward on random goal'] = np.mean(test_rewards)
+
     def endof_episode(self, sample):
         '''
         self.episode_stats['Episode'] = self.episode
@@ -195,26 +316,29 @@ class DDPG_agent():
 
     def run(self):
 
+        if hasattr(self.train_env, 'nb_envs'):
+            self.run_batch()
+            return
+
         self.sess.run(tf.global_variables_initializer())
 
         # Initialize target network weights
-        #TODO : soft vs hard update
-        self.actor.target_train()
-        self.critic.target_train()
+        self.sess.run(self.hard_target_update)
 
         #TODO : load actor and critic if need be
 
         obs0 = self.train_env.reset()
         self.episode_init = obs0
 
-        #TODO : pass on to a sample goal function in the agent, not in the wrapper
-        self.train_goal = self.env_wrapper.sample_goal()
+        self.train_goal = self.sample_goal(obs0)
 
         while self.train_step < self.max_steps:
 
             obs1, sample = self.step(obs0, self.train_goal, test=False)
 
             self.memory.append(sample)
+            if self.dataset_writer is not None:
+                self.dataset_writer.append(sample, self.episode, self.train_goal)
 
             reward = sample['reward']
             self.episode_reward += reward
@@ -232,12 +356,11 @@ class DDPG_agent():
                 self.episode_stats['Episode steps'] = self.episode_step
                 self.episode_stats['Goal reached'] = self.nb_goals_reached
 
-                self.train_env.reset()
-                self.train_goal = self.env_wrapper.sample_goal()
+                obs1 = self.train_env.reset()
+                self.episode_init = obs1
+                self.train_goal = self.sample_goal(obs1)
 
-                #TODO :integrate flusing in memory
-                # if self.with_hindsight:
-                #     self.memory.flush()
+                self.memory.flush()
 
                 for key in sorted(self.episode_stats.keys()):
                     self.logger_episode.logkv(key, self.episode_stats[key])
@@ -254,6 +377,9 @@ class DDPG_agent():
             if self.train_step % self.eval_freq == 0:
                 self.test()
 
+            if self.checkpoint_freq and self.train_step % self.checkpoint_freq == 0:
+                self.memory.checkpoint(self.checkpoint_dir)
+
 
             self.step_stats['Training steps'] = self.train_step
             for key in sorted(self.step_stats.keys()):
@@ -265,3 +391,107 @@ class DDPG_agent():
 
             obs0 = obs1
 
+        if self.dataset_writer is not None:
+            self.dataset_writer.close()
+
+    def run_batch(self):
+        """Version of run for environments holding N instances: each training step collects
+        one transition per instance and does N updates, one per transition as in run.
+        max_steps counts these steps, so a run collects max_steps * N transitions.
+        Finished instances are reset on their own"""
+
+        self.sess.run(tf.global_variables_initializer())
+
+        # Initialize target network weights
+        self.sess.run(self.hard_target_update)
+
+        nb_envs = self.train_env.nb_envs
+        obs0 = self.train_env.reset()
+        starts = obs0[:, 0].copy()
+        goals = self.env_wrapper.sample_goals(obs0, self.nb_goals_reached, nb_envs).astype('float32')
+        episodes = self.episode + np.arange(nb_envs)
+        self.episode += nb_envs
+        episode_steps = np.zeros(nb_envs, dtype='int64')
+        episode_rewards = np.zeros(nb_envs)
+
+        while self.train_step < self.max_steps:
+
+            # Train on the transitions collected so far while the environments step
+            states0, actions = self.act_batch(obs0, goals, test=False)
+            self.train_env.step_async(actions)
+            if self.memory.nb_entries > 3*self.batch_size:
+                self.train(nb_envs)
+            obs1, rewards_env, dones_env, infos = self.train_env.step_wait()
+            samples = self.env_wrapper.process_steps(states0, goals, actions, obs1, rewards_env, dones_env, infos)
+
+            self.memory.append_many(samples)
+            if self.dataset_writer is not None:
+                for k in range(nb_envs):
+                    self.dataset_writer.append({name: values[k] for name, values in samples.items()},
+                                               episodes[k], goals[k])
+
+            episode_rewards += samples['reward']
+            self.total_reward += np.sum(samples['reward'])
+            episode_steps += 1
+
+            terminals = samples['terminal1']
+            ends = terminals | (episode_steps >= self.max_episode_steps)
+            for k in np.flatnonzero(ends):
+                if terminals[k]: self.nb_goals_reached += 1
+
+                self.episode_stats['Episode'] = episodes[k]
+                self.episode_stats['Start'] = starts[k]
+                self.episode_stats['Goal'] = goals[k][0]
+                self.episode_stats['Train reward'] = episode_rewards[k]
+                self.episode_stats['Episode steps'] = episode_steps[k]
+                self.episode_stats['Goal reached'] = self.nb_goals_reached
+                for key in sorted(self.episode_stats.keys()):
+                    self.logger_episode.logkv(key, self.episode_stats[key])
+                self.logger_episode.dumpkvs()
+
+                episodes[k] = self.episode
+                self.episode += 1
+
+            if np.any(ends):
+                obs1 = self.train_env.reset(ends)
+                goals[ends] = self.env_wrapper.sample_goals(obs1[ends], self.nb_goals_reached, np.count_nonzero(ends))
+                starts[ends] = obs1[ends, 0]
+                episode_steps[ends] = 0
+                episode_rewards[ends] = 0
+
+            if self.train_step % self.eval_freq == 0:
+                self.test()
+
+            if self.checkpoint_freq and self.train_step % self.checkpoint_freq == 0:
+                self.memory.checkpoint(self.checkpoint_dir)
+
+            self.step_stats['Training steps'] = self.train_step
+            for key in sorted(self.step_stats.keys()):
+                self.logger_step.logkv(key, self.step_stats[key])
+            self.logger_step.dumpkvs()
+
+            self.train_step += 1
+
+            obs0 = obs1
+
+        if self.dataset_writer is not None:
+            self.dataset_writer.close()
+
+    def run_offline(self):
+        """Train only from the transitions already in memory, without interacting with the environment"""
+
+        self.sess.run(tf.global_variables_initializer())
+
+        # Initialize target network weights
+        self.sess.run(self.hard_target_update)
+
+        while self.train_step < self.max_steps:
+
+            self.train()
+
+            self.step_stats['Training steps'] = self.train_step
+            for key in sorted(self.step_stats.keys()):
+                self.logger_step.logkv(key, self.step_stats[key])
+            self.logger_step.dumpkvs()
+
+            self.train_step += 1
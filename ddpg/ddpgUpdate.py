@@ -0,0 +1,78 @@
+import numpy as np
+import tensorflow as tf
+
+
+class DDPGUpdate(object):
+    def __init__(self, sess, actor, critic, soft_target_update=True):
+        """The whole DDPG update of a minibatch as one graph, run with a single sess.run:
+        targets y = r + gamma * (1 - terminal) * Q'(s1, mu'(s1)), a critic step on the (weighted)
+        squared TD errors, an actor step on -sum Q(s0, mu(s0)) with the updated critic,
+        then the soft update of both target networks (unless soft_target_update is False,
+        in which case the caller copies the targets periodically).
+
+        The actor and critic models are called on the placeholders below, so their weights
+        are shared with ActorNetwork and CriticNetwork, but the optimizers are separate.
+        """
+        self.sess = sess
+        self.actor = actor
+        self.critic = critic
+
+        self.state0 = tf.placeholder(tf.float32, [None, critic.s_dim])
+        self.action = tf.placeholder(tf.float32, [None, critic.a_dim])
+        self.reward = tf.placeholder(tf.float32, [None, 1])
+        self.state1 = tf.placeholder(tf.float32, [None, critic.s_dim])
+        self.terminal1 = tf.placeholder(tf.float32, [None, 1])
+        self.weights = tf.placeholder_with_default(tf.ones_like(self.reward), [None, 1])
+
+        # Targets, no gradient flows into the target networks
+        target_q = critic.target_model([self.state1, actor.target_model(self.state1)])
+        self.y = tf.stop_gradient(self.reward + critic.gamma * (1 - self.terminal1) * target_q)
+
+        # Critic step
+        self.q = critic.model([self.state0, self.action])
+        self.td_errors = self.y - self.q
+        self.critic_loss = tf.reduce_mean(self.weights * tf.square(self.td_errors))
+        self.critic_optimize = tf.train.AdamOptimizer(critic.learning_rate).minimize(
+            self.critic_loss, var_list=critic.model.trainable_weights)
+
+        # Actor step, with the critic read after its own step
+        with tf.control_dependencies([self.critic_optimize]):
+            self.actor_action = actor.model(self.state0)
+            self.actor_q = critic.model([self.state0, self.actor_action])
+            self.actor_loss = -tf.reduce_sum(self.actor_q)
+            self.actor_optimize = tf.train.AdamOptimizer(actor.learning_rate).minimize(
+                self.actor_loss, var_list=actor.model.trainable_weights)
+
+        # Target networks follow the updated networks
+        with tf.control_dependencies([self.actor_optimize]):
+            if soft_target_update:
+                self.update = tf.group(*(actor.build_target_update(actor.tau) +
+                                         critic.build_target_update(critic.tau)))
+            else:
+                self.update = tf.no_op()
+
+        # Same statistics as ActorNetwork.get_stats and CriticNetwork.get_stats
+        self.stat_ops = [tf.reduce_mean(self.actor_action),
+                         tf.reduce_mean(self.q),
+                         tf.reduce_mean(tf.gradients(self.q, self.action))]
+        self.stat_names = ['Mean action', 'Mean Q values', 'reference_action_grads']
+
+    def train(self, samples, with_stats=False):
+        """Run the update on a minibatch, returns the critic loss, the TD errors and the stats if asked"""
+        feed_dict = {self.state0: samples['state0'],
+                     self.action: samples['action'],
+                     self.reward: np.reshape(samples['reward'], (-1, 1)),
+                     self.state1: samples['state1'],
+                     self.terminal1: np.reshape(samples['terminal1'], (-1, 1))}
+        if samples.get('weights') is not None:
+            feed_dict[self.weights] = np.reshape(samples['weights'], (-1, 1))
+
+        fetches = [self.update, self.critic_loss, self.td_errors]
+        if with_stats:
+            fetches += self.stat_ops
+        values = self.sess.run(fetches, feed_dict=feed_dict)
+
+        results = {'Critic loss': values[1], 'td_errors': values[2]}
+        if with_stats:
+            results.update(zip(self.stat_names, values[3:]))
+        return results
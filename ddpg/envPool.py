@@ -0,0 +1,117 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.sharedctypes import RawArray
+
+
+def _worker(env_name, idx, pipe, observations, actions, rewards, dones):
+    import gym
+    env = gym.make(env_name)
+    obs_buffer = np.frombuffer(observations, dtype='float64').reshape(-1, *env.observation_space.shape)
+    action_buffer = np.frombuffer(actions, dtype='float64').reshape(-1, *env.action_space.shape)
+    reward_buffer = np.frombuffer(rewards, dtype='float64')
+    done_buffer = np.frombuffer(dones, dtype='uint8')
+    while True:
+        cmd, data = pipe.recv()
+        if cmd == 'step':
+            obs, reward, done, info = env.step(action_buffer[idx])
+            obs_buffer[idx] = obs
+            reward_buffer[idx] = reward
+            done_buffer[idx] = done
+            pipe.send(info)
+        elif cmd == 'reset':
+            obs_buffer[idx] = env.reset()
+            pipe.send(None)
+        elif cmd == 'seed':
+            env.seed(data)
+            pipe.send(None)
+        elif cmd == 'close':
+            env.close()
+            pipe.close()
+            break
+
+
+class EnvPool(object):
+    def __init__(self, env_name, nb_envs):
+        """nb_envs copies of a gym environment, each stepped in its own worker process.
+
+        Same interface as VecMountainCar: observations are (N, obs_dim) arrays, actions are
+        (N, action_dim) arrays and reset(mask) only resets the selected environments.
+        Observations, actions, rewards and dones go through shared memory, the pipes only
+        carry commands and info dicts. step_async/step_wait and reset_async/reset_wait let
+        the caller work while the environments step.
+        """
+        import gym
+        env = gym.make(env_name)
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        self.action_bound = env.action_space.high
+        env.close()
+
+        self.nb_envs = nb_envs
+        obs_shape = (nb_envs,) + self.observation_space.shape
+        action_shape = (nb_envs,) + self.action_space.shape
+        observations = RawArray('d', int(np.prod(obs_shape)))
+        actions = RawArray('d', int(np.prod(action_shape)))
+        rewards = RawArray('d', nb_envs)
+        dones = RawArray('B', nb_envs)
+        self.observations = np.frombuffer(observations, dtype='float64').reshape(obs_shape)
+        self.actions = np.frombuffer(actions, dtype='float64').reshape(action_shape)
+        self.rewards = np.frombuffer(rewards, dtype='float64')
+        self.dones = np.frombuffer(dones, dtype='uint8')
+
+        self.pipes = []
+        self.processes = []
+        for idx in range(nb_envs):
+            pipe, worker_pipe = mp.Pipe()
+            process = mp.Process(target=_worker,
+                                 args=(env_name, idx, worker_pipe, observations, actions, rewards, dones))
+            process.daemon = True
+            process.start()
+            worker_pipe.close()
+            self.pipes.append(pipe)
+            self.processes.append(process)
+        self.waiting = []
+
+    def seed(self, seed=None):
+        for idx, pipe in enumerate(self.pipes):
+            pipe.send(('seed', None if seed is None else seed + idx))
+        for pipe in self.pipes:
+            pipe.recv()
+
+    def reset_async(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.nb_envs, dtype=bool)
+        self.waiting = np.flatnonzero(mask)
+        for idx in self.waiting:
+            self.pipes[idx].send(('reset', None))
+
+    def reset_wait(self):
+        for idx in self.waiting:
+            self.pipes[idx].recv()
+        self.waiting = []
+        return self.observations.copy()
+
+    def reset(self, mask=None):
+        self.reset_async(mask)
+        return self.reset_wait()
+
+    def step_async(self, actions):
+        self.actions[:] = np.reshape(actions, self.actions.shape)
+        self.waiting = np.arange(self.nb_envs)
+        for pipe in self.pipes:
+            pipe.send(('step', None))
+
+    def step_wait(self):
+        infos = [self.pipes[idx].recv() for idx in self.waiting]
+        self.waiting = []
+        return self.observations.copy(), self.rewards.copy(), self.dones.astype(bool), infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        for pipe in self.pipes:
+            pipe.send(('close', None))
+        for process in self.processes:
+            process.join()
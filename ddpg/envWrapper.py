@@ -1,5 +1,26 @@
 import numpy as np
-import math
+
+
+def sample_outside(centers, eps, low, high):
+    """One uniform draw in [low, high] outside of ]c-eps, c+eps[ per center c, without rejection:
+    a draw over the total allowed length is mapped to the interval on either side of the ball"""
+    centers = np.asarray(centers, dtype='float64')
+    below = np.clip(centers - eps, low, high) - low
+    above = high - np.clip(centers + eps, low, high)
+    u = np.random.uniform(size=centers.shape) * (below + above)
+    return np.where(u < below, low + u, centers + eps + u - below)
+
+
+def curriculum_table(difficulties):
+    """For each difficulty, the indices of the goal space intervals that have it,
+    padded to a rectangular table, and how many there are"""
+    difficulties = np.asarray(difficulties)
+    intervals = [np.flatnonzero(difficulties == d) for d in range(difficulties.max() + 1)]
+    counts = np.array([len(idxs) for idxs in intervals])
+    table = np.zeros((len(intervals), counts.max()), dtype='int64')
+    for d, idxs in enumerate(intervals):
+        table[d, :len(idxs)] = idxs
+    return table, counts
 
 class NoGoal(object):
     def __init__(self):
@@ -16,12 +37,15 @@ class NoGoal(object):
         return observation
 
     def evaluate_transition(self, state0, action, state1):
-        r = 0
-        term = False
-        if state1[self.obs_to_goal] >= 0.45:
-            r += 100
-            term = True
-        r -= math.pow(action[0], 2) * 0.1
+        r, term = self.evaluate_transitions(np.reshape(state0, (1, -1)),
+                                            np.reshape(action, (1, -1)),
+                                            np.reshape(state1, (1, -1)))
+        return float(r[0]), bool(term[0])
+
+    def evaluate_transitions(self, state0, action, state1):
+        """Batch version of evaluate_transition over (N, dim) arrays"""
+        term = np.all(state1[:, self.obs_to_goal] >= 0.45, axis=1)
+        r = 100 * term - np.square(action[:, 0]) * 0.1
         return r, term
 
     def evaluate_goal(self, state):
@@ -30,15 +54,18 @@ class NoGoal(object):
     def sample_initial_goal(self):
         return [0.45]
 
-    def sample_goal(self):
+    def sample_goal(self, obs=None, successes=0):
         return self.sample_initial_goal()
 
+    def sample_goals(self, obs_batch, successes, n):
+        return np.tile(self.sample_initial_goal(), (n, 1))
+
     def sample_random_goal(self, obs):
-        goal_found = False
-        while not goal_found:
-            goal = np.random.uniform([-1.2], [0.6], (1,))
-            goal_found = np.abs(obs[self.obs_to_goal]-goal) > self.eps
-        return goal
+        return self.sample_random_goals(np.reshape(obs, (1, -1)))[0]
+
+    def sample_random_goals(self, obs_batch):
+        """Uniform goals at more than eps from each observation of the batch"""
+        return sample_outside(obs_batch[:, self.obs_to_goal], self.eps, -1.2, 0.6)
 
     def process_step(self, state0, goal, action, new_obs, r_env, done_env, info):
         # Compute next complete state
@@ -55,6 +82,23 @@ class NoGoal(object):
 
         return buffer_item
 
+    def process_observations(self, observations, goals):
+        """Batch version of process_observation over (N, dim) arrays"""
+        return observations
+
+    def process_steps(self, states0, goals, actions, new_obs, r_env, done_env, infos):
+        """Batch version of process_step, for N environments stepped together"""
+        states1 = self.process_observations(new_obs, goals)
+        r, done = self.evaluate_transitions(states0, actions, states1)
+
+        buffer_items = {'state0': states0,
+                        'action': actions,
+                        'reward': r,
+                        'state1': states1,
+                        'terminal1': done}
+
+        return buffer_items
+
 class RandomGoal(object):
     def __init__(self):
         # Specific to continuous mountain car
@@ -86,21 +130,48 @@ class RandomGoal(object):
 
         return buffer_item
 
+    def process_observations(self, observations, goals):
+        """Batch version of process_observation over (N, dim) arrays"""
+        return np.concatenate([observations, goals], axis=1)
+
+    def process_steps(self, states0, goals, actions, new_obs, r_env, done_env, infos):
+        """Batch version of process_step, for N environments stepped together"""
+        states1 = self.process_observations(new_obs, goals)
+        r, done = self.evaluate_transitions(states0, actions, states1)
+
+        buffer_items = {'state0': states0,
+                        'action': actions,
+                        'reward': r,
+                        'state1': states1,
+                        'terminal1': done}
+
+        return buffer_items
+
     def evaluate_transition(self, state0, action, state1):
-        r = 0
-        term = False
-        if np.abs(state1[self.state_to_obs][self.obs_to_goal] - state1[self.state_to_goal]) < self.eps:
-            r += 100
-            term = True
-        r -= math.pow(action[0], 2) * 0.1
+        r, term = self.evaluate_transitions(np.reshape(state0, (1, -1)),
+                                            np.reshape(action, (1, -1)),
+                                            np.reshape(state1, (1, -1)))
+        return float(r[0]), bool(term[0])
+
+    def evaluate_transitions(self, state0, action, state1):
+        """Batch version of evaluate_transition over (N, dim) arrays"""
+        achieved = state1[:, np.take(self.state_to_obs, self.obs_to_goal)]
+        term = np.all(np.abs(achieved - state1[:, self.state_to_goal]) < self.eps, axis=1)
+        r = 100 * term - np.square(action[:, 0]) * 0.1
         return r, term
 
     def sample_goal(self, obs, successes):
-        goal_found = False
-        while not goal_found:
-            goal = np.random.uniform([-1.2], [0.6], (1,))
-            goal_found = np.abs(obs[self.obs_to_goal]-goal) > self.eps
-        return goal
+        return self.sample_random_goal(obs)
+
+    def sample_goals(self, obs_batch, successes, n):
+        return self.sample_random_goals(obs_batch)
+
+    def sample_random_goal(self, obs):
+        return self.sample_random_goals(np.reshape(obs, (1, -1)))[0]
+
+    def sample_random_goals(self, obs_batch):
+        """Uniform goals at more than eps from each observation of the batch"""
+        return sample_outside(obs_batch[:, self.obs_to_goal], self.eps, -1.2, 0.6)
 
     def sample_initial_goal(self):
         return [0.45]
@@ -136,21 +207,52 @@ class InitialGoal(object):
 
         return buffer_item
 
+    def process_observations(self, observations, goals):
+        """Batch version of process_observation over (N, dim) arrays"""
+        return np.concatenate([observations, goals], axis=1)
+
+    def process_steps(self, states0, goals, actions, new_obs, r_env, done_env, infos):
+        """Batch version of process_step, for N environments stepped together"""
+        states1 = self.process_observations(new_obs, goals)
+        r, done = self.evaluate_transitions(states0, actions, states1)
+
+        buffer_items = {'state0': states0,
+                        'action': actions,
+                        'reward': r,
+                        'state1': states1,
+                        'terminal1': done}
+
+        return buffer_items
+
     def evaluate_transition(self, state0, action, state1):
-        r = 0
-        term = False
-        if np.abs(state1[self.state_to_obs][self.obs_to_goal] - state1[self.state_to_goal]) < self.eps:
-            r += 100
-            term = True
-        r -= math.pow(action[0], 2) * 0.1
+        r, term = self.evaluate_transitions(np.reshape(state0, (1, -1)),
+                                            np.reshape(action, (1, -1)),
+                                            np.reshape(state1, (1, -1)))
+        return float(r[0]), bool(term[0])
+
+    def evaluate_transitions(self, state0, action, state1):
+        """Batch version of evaluate_transition over (N, dim) arrays"""
+        achieved = state1[:, np.take(self.state_to_obs, self.obs_to_goal)]
+        term = np.all(np.abs(achieved - state1[:, self.state_to_goal]) < self.eps, axis=1)
+        r = 100 * term - np.square(action[:, 0]) * 0.1
         return r, term
 
     def sample_goal(self, obs, successes):
         return [0.45]
 
+    def sample_goals(self, obs_batch, successes, n):
+        return np.tile(self.sample_initial_goal(), (n, 1))
+
     def sample_initial_goal(self):
         return [0.45]
 
+    def sample_random_goal(self, obs):
+        return self.sample_random_goals(np.reshape(obs, (1, -1)))[0]
+
+    def sample_random_goals(self, obs_batch):
+        """Uniform goals at more than eps from each observation of the batch"""
+        return sample_outside(obs_batch[:, self.obs_to_goal], self.eps, -1.2, 0.6)
+
 class HandmadeCurriculum(object):
     def __init__(self):
         # Specific to continuous mountain car
@@ -166,6 +268,7 @@ class HandmadeCurriculum(object):
         self.difficulties = np.array([6, 5, 4, 3, 2, 1, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
         self.means = np.linspace(4, 10, 100)
         self.stds = np.linspace(0.5, 2, 100)
+        self.interval_table, self.interval_counts = curriculum_table(self.difficulties)
 
     def process_observation(self, observation, goal):
         return np.concatenate([observation,goal])
@@ -185,33 +288,63 @@ class HandmadeCurriculum(object):
 
         return buffer_item
 
+    def process_observations(self, observations, goals):
+        """Batch version of process_observation over (N, dim) arrays"""
+        return np.concatenate([observations, goals], axis=1)
+
+    def process_steps(self, states0, goals, actions, new_obs, r_env, done_env, infos):
+        """Batch version of process_step, for N environments stepped together"""
+        states1 = self.process_observations(new_obs, goals)
+        r, done = self.evaluate_transitions(states0, actions, states1)
+
+        buffer_items = {'state0': states0,
+                        'action': actions,
+                        'reward': r,
+                        'state1': states1,
+                        'terminal1': done}
+
+        return buffer_items
+
     def evaluate_transition(self, state0, action, state1):
-        r = 0
-        term = False
-        if np.abs(state1[self.state_to_obs][self.obs_to_goal] - state1[self.state_to_goal]) < self.eps:
-            r += 100
-            term = True
-        r -= math.pow(action[0], 2) * 0.1
+        r, term = self.evaluate_transitions(np.reshape(state0, (1, -1)),
+                                            np.reshape(action, (1, -1)),
+                                            np.reshape(state1, (1, -1)))
+        return float(r[0]), bool(term[0])
+
+    def evaluate_transitions(self, state0, action, state1):
+        """Batch version of evaluate_transition over (N, dim) arrays"""
+        achieved = state1[:, np.take(self.state_to_obs, self.obs_to_goal)]
+        term = np.all(np.abs(achieved - state1[:, self.state_to_goal]) < self.eps, axis=1)
+        r = 100 * term - np.square(action[:, 0]) * 0.1
         return r, term
 
     def sample_goal(self, obs, successes):
+        difficulties, goals = self.sample_difficulties_goals(successes, 1)
+        return difficulties[0], goals[0]
+
+    def sample_goals(self, obs_batch, successes, n):
+        return self.sample_difficulties_goals(successes, n)[1]
+
+    def sample_difficulties_goals(self, successes, n):
+        """Draw n difficulties around the level reached after successes, then a goal
+        in one of the intervals of the goal space that have each difficulty"""
         mean = self.means[min(successes, 99)]
         std = self.stds[min(successes, 99)]
-        difficulty = np.clip(int(np.random.normal(mean,std)), 1, 10)
-        indices = np.squeeze(np.argwhere(self.difficulties==difficulty), axis=1)
-        idx = np.random.choice(indices)
-        goal = np.random.uniform(self.disc_goal_space[idx], self.disc_goal_space[idx+1], (1,))
-        return difficulty, goal
+        difficulties = np.clip(np.trunc(np.random.normal(mean, std, n)).astype('int64'), 1, 10)
+        choices = (np.random.random(n) * self.interval_counts[difficulties]).astype('int64')
+        idxs = self.interval_table[difficulties, choices]
+        goals = np.random.uniform(self.disc_goal_space[idxs], self.disc_goal_space[idxs + 1])
+        return difficulties, goals.reshape(n, 1)
 
     def sample_initial_goal(self):
         return [0.45]
 
     def sample_random_goal(self, obs):
-        goal_found = False
-        while not goal_found:
-            goal = np.random.uniform([-1.2], [0.6], (1,))
-            goal_found = np.abs(obs[self.obs_to_goal]-goal) > self.eps
-        return goal
+        return self.sample_random_goals(np.reshape(obs, (1, -1)))[0]
+
+    def sample_random_goals(self, obs_batch):
+        """Uniform goals at more than eps from each observation of the batch"""
+        return sample_outside(obs_batch[:, self.obs_to_goal], self.eps, -1.2, 0.6)
 
 class Curriculum(object):
     def __init__(self):
@@ -228,6 +361,7 @@ class Curriculum(object):
         self.difficulties = [6, 5, 4, 3, 2, 1, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
         self.means = np.linspace(2, 10, 100)
         self.stds = np.linspace(0.5, 9, 100)
+        self.interval_table, self.interval_counts = curriculum_table(self.difficulties)
 
     def process_observation(self, observation, goal):
         return np.concatenate([observation,goal])
@@ -247,30 +381,60 @@ class Curriculum(object):
 
         return buffer_item
 
+    def process_observations(self, observations, goals):
+        """Batch version of process_observation over (N, dim) arrays"""
+        return np.concatenate([observations, goals], axis=1)
+
+    def process_steps(self, states0, goals, actions, new_obs, r_env, done_env, infos):
+        """Batch version of process_step, for N environments stepped together"""
+        states1 = self.process_observations(new_obs, goals)
+        r, done = self.evaluate_transitions(states0, actions, states1)
+
+        buffer_items = {'state0': states0,
+                        'action': actions,
+                        'reward': r,
+                        'state1': states1,
+                        'terminal1': done}
+
+        return buffer_items
+
     def evaluate_transition(self, state0, action, state1):
-        r = 0
-        term = False
-        if np.abs(state1[self.state_to_obs][self.obs_to_goal] - state1[self.state_to_goal]) < self.eps:
-            r += 100
-            term = True
-        r -= math.pow(action[0], 2) * 0.1
+        r, term = self.evaluate_transitions(np.reshape(state0, (1, -1)),
+                                            np.reshape(action, (1, -1)),
+                                            np.reshape(state1, (1, -1)))
+        return float(r[0]), bool(term[0])
+
+    def evaluate_transitions(self, state0, action, state1):
+        """Batch version of evaluate_transition over (N, dim) arrays"""
+        achieved = state1[:, np.take(self.state_to_obs, self.obs_to_goal)]
+        term = np.all(np.abs(achieved - state1[:, self.state_to_goal]) < self.eps, axis=1)
+        r = 100 * term - np.square(action[:, 0]) * 0.1
         return r, term
 
     def sample_goal(self, obs, successes):
+        difficulties, goals = self.sample_difficulties_goals(successes, 1)
+        return difficulties[0], goals[0]
+
+    def sample_goals(self, obs_batch, successes, n):
+        return self.sample_difficulties_goals(successes, n)[1]
+
+    def sample_difficulties_goals(self, successes, n):
+        """Draw n difficulties around the level reached after successes, then a goal
+        in one of the intervals of the goal space that have each difficulty"""
         mean = self.means[min(successes, 99)]
         std = self.stds[min(successes, 99)]
-        difficulty = np.clip(int(np.random.normal(mean,std)), 1, 10)
-        indices = np.squeeze(np.argwhere(self.difficulties==difficulty))
-        idx = np.random.choice(indices)
-        goal = np.random.uniform(self.disc_goal_space[idx], self.disc_goal_space[idx+1], (1,))
-        return difficulty, goal
+        difficulties = np.clip(np.trunc(np.random.normal(mean, std, n)).astype('int64'), 1, 10)
+        choices = (np.random.random(n) * self.interval_counts[difficulties]).astype('int64')
+        idxs = self.interval_table[difficulties, choices]
+        goals = np.random.uniform(self.disc_goal_space[idxs], self.disc_goal_space[idxs + 1])
+        return difficulties, goals.reshape(n, 1)
 
     def sample_initial_goal(self):
         return [0.45]
 
     def sample_random_goal(self, obs):
-        goal_found = False
-        while not goal_found:
-            goal = np.random.uniform([-1.2], [0.6], (1,))
-            goal_found = np.abs(obs[self.obs_to_goal]-goal) > self.eps
-        return goal
+        return self.sample_random_goals(np.reshape(obs, (1, -1)))[0]
+
+    def sample_random_goals(self, obs_batch):
+        """Uniform goals at more than eps from each observation of the batch"""
+        return sample_outside(obs_batch[:, self.obs_to_goal], self.eps, -1.2, 0.6)
@@ -1,93 +1,62 @@
-import tensorflow as tf
 import numpy as np
-import gym
 import argparse
 import pprint as pp
+import os
 from logger import Logger
-from memory import Memory
-import pickle
 from envWrapper import NoGoal
-from perf_config_mcc import PerfConfig
-from actor import ActorNetwork
-from critic import CriticNetwork
-from myddpgAgent import DDPG_agent
-from noise import OrnsteinUhlenbeckActionNoise, NoNoise
-
-from rl.utils.printer import print_info
-import os
-
-# Configuration
-config = PerfConfig()
-env = config.env
-
-results_path = './eval/'
-logger_step = Logger(dir=results_path,format_strs=['json'])
-logger_episode = Logger(dir=results_path, format_strs=[])
-                
-env_wrapper = NoGoal()
-
-state_dim = env_wrapper.state_shape[0]
-action_dim = env_wrapper.action_shape[0]
-action_bound = env.action_space.high
-# Ensure action bound is symmetric
-assert (env.action_space.high == -env.action_space.low)
-
-memory = Memory(env_wrapper, with_reward=True, limit=int(1e6))
-
-# Noise
-#actor_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros(action_dim))
-actor_noise = NoNoise()
-
-class Evaluator:
-
-        def eval(self,filename):
-                with tf.Session() as sess:
-
-                        if not config.random_seed:
-                                np.random.seed(config.seed)
-                                tf.set_random_seed(config.seed)
-                                env.seed(config.seed)
-
-                        actor = ActorNetwork(sess,
-                                             state_dim,
-                                             action_dim,
-                                             action_bound,
-                                             config.tau,
-                                             config.actor_lr)
-
-                        print("evaluating : ", filename)
-                        #actor.print_target_weights()
-                        actor.load_target_weights(filename)
-                        #actor.print_target_weights()
-                        actor.load_weights(filename)
-
-                        critic = CriticNetwork(sess,
-                                               state_dim,
-                                               action_dim,
-                                               config.gamma,
-                                               config.tau,
-                                               config.critic_lr)
-
-                        agent = DDPG_agent(sess,
-                                           actor,
-                                           actor_noise,
-                                           critic,
-                                           env,
-                                           env,
-                                           env_wrapper,
-                                           memory,
-                                           logger_step,
-                                           logger_episode,
-                                           config.batch_size,
-                                           config.eval_episodes,
-                                           config.max_episode_steps,
-                                           config.max_steps,
-                                           config.eval_freq)
-                        for i in range(5):
-                                agent.test()
-
-
-path = "./actors/"
-collec = Evaluator()
-for actor in os.listdir(path):
-    collec.eval(path+actor)
+from numpyNetwork import NumpyNetwork
+from vecEnv import VecMountainCar
+
+# Evaluates actors exported with ActorNetwork.export, without tensorflow nor gym:
+# the episodes of each actor are played together on the numpy mountain car
+
+
+def evaluate(actor, env, env_wrapper, max_episode_steps):
+    """Rewards of one episode per car of env, playing the actor without noise"""
+    obs = env.reset()
+    goals = np.tile(env_wrapper.sample_initial_goal(), (env.nb_envs, 1))
+    rewards = np.zeros(env.nb_envs)
+    running = np.ones(env.nb_envs, dtype=bool)
+    for k in range(max_episode_steps):
+        states0 = env_wrapper.process_observations(obs, goals)
+        actions = actor.predict(states0)
+        obs, _, _, _ = env.step(actions)
+        r, terminals = env_wrapper.evaluate_transitions(states0, actions, env_wrapper.process_observations(obs, goals))
+        rewards += running * r
+        running &= ~terminals
+        if not np.any(running):
+            break
+    return rewards
+
+
+def main(args):
+    logger = Logger(dir=args['results_dir'], format_strs=['stdout', 'json'])
+    env_wrapper = NoGoal()
+    env = VecMountainCar(int(args['eval_episodes']))
+    if args['random_seed'] is not None:
+        env.seed(int(args['random_seed']))
+
+    for filename in sorted(os.listdir(args['actors_dir'])):
+        if not filename.endswith('.npz'):
+            continue
+        print("evaluating : ", filename)
+        actor = NumpyNetwork(os.path.join(args['actors_dir'], filename))
+        rewards = evaluate(actor, env, env_wrapper, int(args['max_episode_steps']))
+        logger.logkv('Actor', filename)
+        logger.logkv('Test reward on initial goal', np.mean(rewards))
+        logger.dumpkvs()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='evaluate exported actors on the mountain car')
+    parser.add_argument('--actors-dir', help='directory of the .npz actors to evaluate', default='./actors/')
+    parser.add_argument('--results-dir', help='directory for the evaluation logs', default='./eval/')
+    parser.add_argument('--eval-episodes', help='number of episodes per actor', default=20)
+    parser.add_argument('--max-episode-steps', help='max number of steps per episode', default=1000)
+    parser.add_argument('--random-seed', help='random seed for repeatability', default=None)
+
+    args = vars(parser.parse_args())
+
+    pp.pprint(args)
+
+    main(args)
@@ -0,0 +1,56 @@
+import argparse
+import pprint as pp
+from envWrapper import RandomGoal, NoGoal, HandmadeCurriculum
+from memory import Memory, manceron_chunks, pickled_memory_chunks
+from printer import print_status
+
+# Converts recorded replay buffers into a memory-mapped buffer directory,
+# which main.py --open-buffer (Memory.load_from_directory) then reopens without reading its content.
+
+
+def import_buffer(chunks, memory):
+    """Append chunks of transitions to memory, printing the progress"""
+    nb_transitions = 0
+    for chunk in chunks:
+        memory.append_many(chunk)
+        nb_transitions += len(chunk['state0'])
+        print_status("Imported {} transitions".format(nb_transitions))
+    print_status("Imported {} transitions".format(nb_transitions), terminal=True)
+    return memory
+
+
+def main(args):
+    if args['wrapper'] == 'NoGoal':
+        env_wrapper = NoGoal()
+    elif args['wrapper'] == 'RandomGoal':
+        env_wrapper = RandomGoal()
+    elif args['wrapper'] == 'HandCurri':
+        env_wrapper = HandmadeCurriculum()
+
+    chunk_size = int(args['chunk_size'])
+    if args['format'] == 'manceron':
+        chunks = manceron_chunks(args['input'], chunk_size)
+    else:
+        chunks = pickled_memory_chunks(args['input'], chunk_size)
+
+    memory = Memory(env_wrapper, with_reward=True, limit=int(args['buffer_size']), directory=args['output'])
+    import_buffer(chunks, memory)
+    memory.buffer.sync()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert a recorded replay buffer to a memory-mapped buffer')
+
+    parser.add_argument('--input', help='pickled replay buffer', required=True)
+    parser.add_argument('--output', help='directory of the memory-mapped buffer', required=True)
+    parser.add_argument('--format', help='manceron for lists of transition tuples, memory for Memory.save pickles',
+                        default='memory', choices=['manceron', 'memory'])
+    parser.add_argument('--wrapper', help='wrapper the transitions were recorded with', default='NoGoal')
+    parser.add_argument('--buffer-size', help='max size of the replay buffer', default=1000000)
+    parser.add_argument('--chunk-size', help='number of transitions converted at once', default=100000)
+
+    args = vars(parser.parse_args())
+
+    pp.pprint(args)
+
+    main(args)
@@ -5,14 +5,20 @@ import argparse
 import pprint as pp
 from logger import Logger
 from envWrapper import RandomGoal, NoGoal, HandmadeCurriculum
-from memory import Memory, HerMemory
+from memory import Memory, HerMemory, LazyHerMemory, ObservationMemory, PrioritizedMemory, PrioritizedHerMemory, \
+    StratifiedMemory, load_checkpoint
 import pickle
 import time
 import datetime
 from actor import ActorNetwork
 from critic import CriticNetwork
 from ddpgAgent import DDPG_agent
+from ddpgUpdate import DDPGUpdate
 from noise import OrnsteinUhlenbeckActionNoise
+from prefetch import Prefetcher
+from dataset import DatasetWriter, OfflineMemory
+from vecEnv import VecMountainCar
+from envPool import EnvPool
 
 #TODO : Update doc on github on this code
 
@@ -37,9 +43,21 @@ def main(args):
     max_episode_steps = int(args['max_episode_steps'])
     max_steps = int(args['max_steps'])
     eval_freq = int(args['eval_freq'])
+    buffer_size = int(args['buffer_size'])
 
-    train_env = gym.make(args['env'])
-    test_env = gym.make(args['env'])
+    nb_envs = int(args['nb_envs'])
+    if nb_envs > 0:
+        assert not (args['with_hindsight'] or args['dedup_observations']), \
+            'episodes of parallel environments are interleaved, which hindsight and deduplicated memories do not support'
+    if nb_envs > 0 and args['env'] == 'MountainCarContinuous-v0' and not args['env_pool']:
+        train_env = VecMountainCar(nb_envs)
+        test_env = VecMountainCar(eval_episodes)
+    elif nb_envs > 0:
+        train_env = EnvPool(args['env'], nb_envs)
+        test_env = EnvPool(args['env'], min(nb_envs, eval_episodes))
+    else:
+        train_env = gym.make(args['env'])
+        test_env = gym.make(args['env'])
 
 
     if args['wrapper'] == 'NoGoal':
@@ -53,18 +71,56 @@ def main(args):
 
     state_dim = env_wrapper.state_shape[0]
     action_dim = env_wrapper.action_shape[0]
-    action_bound = train_env.action_space.high
-    # Ensure action bound is symmetric
-    assert (train_env.action_space.high == -train_env.action_space.low)
-
-    actor_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros(action_dim))
+    if nb_envs > 0:
+        action_bound = train_env.action_bound
+        # One noise process per car
+        actor_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros((nb_envs, action_dim)))
+    else:
+        action_bound = train_env.action_space.high
+        # Ensure action bound is symmetric
+        assert (train_env.action_space.high == -train_env.action_space.low)
+        actor_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros(action_dim))
 
     # Initialize replay memory
-    if args['with_hindsight']:
-        memory = HerMemory(env_wrapper, with_reward=True, limit=int(1e6), strategy='last')
+    if args['buffer_backend'] == 'memmap':
+        buffer_dir = final_dir+'/buffer'
     else:
-        memory = Memory(env_wrapper, with_reward=True, limit=int(1e6))
+        buffer_dir = None
+    if args['offline_dir'] is not None:
+        memory = OfflineMemory(args['offline_dir'])
+    elif args['load_buffer'] is not None:
+        memory = load_checkpoint(args['load_buffer'], env_wrapper, buffer_dir)
+    elif args['open_buffer'] is not None:
+        # Warm start from a memory-mapped buffer, e.g. written by importBuffer.py, new transitions go there too
+        memory = Memory(env_wrapper, with_reward=True, limit=buffer_size, storage=args['storage'])
+        memory.load_from_directory(args['open_buffer'])
+    elif args['with_hindsight'] and args['her_strategy'] != 'last':
+        memory = LazyHerMemory(env_wrapper, with_reward=True, limit=buffer_size, strategy=args['her_strategy'],
+                               relabel_ratio=float(args['relabel_ratio']), directory=buffer_dir,
+                               storage=args['storage'])
+    elif args['with_hindsight'] and args['prioritized']:
+        memory = PrioritizedHerMemory(env_wrapper, with_reward=True, limit=buffer_size, strategy='last',
+                                      max_episode_steps=max_episode_steps,
+                                      alpha=float(args['alpha']), beta=float(args['beta']), directory=buffer_dir,
+                                      storage=args['storage'])
+    elif args['with_hindsight']:
+        memory = HerMemory(env_wrapper, with_reward=True, limit=buffer_size, strategy='last',
+                           max_episode_steps=max_episode_steps, directory=buffer_dir, storage=args['storage'])
+    elif args['prioritized']:
+        memory = PrioritizedMemory(env_wrapper, with_reward=True, limit=buffer_size,
+                                   alpha=float(args['alpha']), beta=float(args['beta']), directory=buffer_dir,
+                                   storage=args['storage'])
+    elif float(args['positive_fraction']) > 0:
+        memory = StratifiedMemory(env_wrapper, with_reward=True, limit=buffer_size,
+                                  positive_fraction=float(args['positive_fraction']), directory=buffer_dir,
+                                  storage=args['storage'])
+    elif args['dedup_observations']:
+        memory = ObservationMemory(env_wrapper, with_reward=True, limit=buffer_size, directory=buffer_dir)
+    else:
+        memory = Memory(env_wrapper, with_reward=True, limit=buffer_size, directory=buffer_dir, storage=args['storage'])
 
+    print('Replay buffer memory usage (bytes):')
+    pp.pprint(memory.memory_usage())
 
     with tf.Session() as sess:
 
@@ -88,6 +144,24 @@ def main(args):
                                tau,
                                critic_lr)
 
+        if int(args['prefetch']) > 0:
+            if args['max_staleness'] is not None:
+                max_staleness = int(args['max_staleness'])
+            else:
+                max_staleness = None
+            memory = Prefetcher(memory, batch_size, queue_size=int(args['prefetch']), max_staleness=max_staleness,
+                                actor=actor if args['prefetch_targets'] else None)
+
+        if args['fused_update']:
+            fused_update = DDPGUpdate(sess, actor, critic, soft_target_update=args['target_update'] == 'soft')
+        else:
+            fused_update = None
+
+        if args['export_dir'] is not None:
+            dataset_writer = DatasetWriter(args['export_dir'], env_wrapper)
+        else:
+            dataset_writer = None
+
         agent = DDPG_agent(sess,
                            actor,
                            actor_noise,
@@ -102,8 +176,28 @@ def main(args):
                            eval_episodes,
                            max_episode_steps,
                            max_steps,
-                           eval_freq)
-        agent.run()
+                           eval_freq,
+                           checkpoint_dir=final_dir+'/checkpoint',
+                           checkpoint_freq=int(args['checkpoint_freq']),
+                           dataset_writer=dataset_writer,
+                           fused_update=fused_update,
+                           target_update=args['target_update'],
+                           target_update_freq=int(args['target_update_freq']),
+                           stats_freq=int(args['stats_freq']))
+        if args['offline_dir'] is not None:
+            agent.run_offline()
+        else:
+            agent.run()
+
+        # Networks usable without tensorflow, by eval_actor.py and the plots
+        actor.export(final_dir+'/actor.npz', target=True)
+        critic.export(final_dir+'/critic.npz', target=True)
+
+        if int(args['prefetch']) > 0:
+            memory.stop()
+
+    train_env.close()
+    test_env.close()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='provide arguments for DDPG agent')
@@ -114,7 +208,36 @@ if __name__ == '__main__':
     parser.add_argument('--gamma', help='discount factor for critic updates', default=0.99)
     parser.add_argument('--delta', help='delta in huber loss', default=None)
     parser.add_argument('--tau', help='soft target update parameter', default=0.001)
+    parser.add_argument('--target-update', help='move the target networks by tau at each step, or copy the networks '
+                                                'every --target-update-freq steps', default='soft',
+                        choices=['soft', 'hard'])
+    parser.add_argument('--target-update-freq', help='training steps between hard target updates', default=1000)
     parser.add_argument('--buffer-size', help='max size of the replay buffer', default=1000000)
+    parser.add_argument('--buffer-backend', help='keep the replay buffer in ram or in memory-mapped files', default='ram',
+                        choices=['ram', 'memmap'])
+    parser.add_argument('--her-strategy', help='last relabels whole episodes when they end, '
+                                               'future/episode/final relabel minibatches at sampling time '
+                                               '(not combined with --prioritized)',
+                        default='last', choices=['last', 'future', 'episode', 'final'])
+    parser.add_argument('--relabel-ratio', help='fraction of relabeled transitions in each minibatch', default=0.8)
+    parser.add_argument('--storage', help='precision of the fields stored in the replay buffer', default='float32',
+                        choices=['float32', 'float16', 'quantized'])
+    parser.add_argument('--dedup-observations', help='store each observation once per step and each goal once '
+                                                     'per episode (without hindsight or prioritized replay)',
+                        action='store_true')
+    parser.add_argument('--positive-fraction', help='fraction of each minibatch drawn among the transitions reaching '
+                                                    'the goal, 0 for uniform sampling', default=0)
+    parser.add_argument('--prioritized', help='sample transitions proportionally to their TD error', action='store_true')
+    parser.add_argument('--alpha', help='prioritization exponent of prioritized replay', default=0.6)
+    parser.add_argument('--beta', help='importance sampling exponent of prioritized replay', default=0.4)
+    parser.add_argument('--prefetch', help='number of minibatches sampled ahead by a background thread, 0 to disable',
+                        default=0)
+    parser.add_argument('--max-staleness', help='drop prefetched minibatches drawn more than this many appends ago',
+                        default=None)
+    parser.add_argument('--prefetch-targets', help='compute the target actions in the prefetching thread',
+                        action='store_true')
+    parser.add_argument('--fused-update', help='run the critic, actor and target updates of a minibatch as a single '
+                                               'tensorflow graph', action='store_true')
     parser.add_argument('--minibatch-size', help='size of minibatch for minibatch-SGD', default=64)
     parser.add_argument('--wrapper', help='concatenate goal and observation in states', default='NoGoal')
     parser.add_argument('--with-hindsight', help='use hindsight experience replay', action='store_true')
@@ -122,15 +245,37 @@ if __name__ == '__main__':
     # run parameters
     parser.add_argument('--env', help='choose the gym env- tested on {Pendulum-v0}', default='MountainCarContinuous-v0')
     parser.add_argument('--random-seed', help='random seed for repeatability', default=None)
-    parser.add_argument('--max-steps', help='max num of episodes to do while training', default=500000)
+    parser.add_argument('--max-steps', help='max num of training steps, with --nb-envs each step collects one '
+                                           'transition per environment and does as many updates', default=500000)
     parser.add_argument('--max-episode-steps', help='max number of steps before resetting environment', default=100)
+    parser.add_argument('--nb-envs', help='number of environments stepped together, mountain cars are simulated '
+                                          'with numpy and other environments in worker processes, 0 for a single '
+                                          'gym environment', default=0)
+    parser.add_argument('--env-pool', help='run the mountain cars in worker processes as well', action='store_true')
     parser.add_argument('--monitor-dir', help='directory for storing gym results', default='./results/gym_ddpg')
     parser.add_argument('--summary-dir', help='directory for storing tensorboard info', default='./results/v2')
     parser.add_argument('--eval-freq', help='evaluation frequency', default=100)
     parser.add_argument('--eval-episodes', help='number of episodes to run during evaluation', default=20)
+    parser.add_argument('--stats-freq', help='training steps over which the network statistics are averaged before '
+                                             'being logged, 0 to disable them', default=1)
+    parser.add_argument('--checkpoint-freq', help='steps between incremental replay buffer checkpoints, 0 to disable',
+                        default=0)
+    parser.add_argument('--load-buffer', help='checkpoint directory to restore the replay buffer from', default=None)
+    parser.add_argument('--open-buffer', help='memory-mapped buffer directory (from importBuffer.py or '
+                                              '--buffer-backend memmap) to reopen in place and keep filling',
+                        default=None)
+    parser.add_argument('--export-dir', help='directory where to write every collected transition as dataset shards',
+                        default=None)
+    parser.add_argument('--offline-dir', help='train from the dataset shards in this directory, without interacting '
+                                              'with the environment', default=None)
     parser.add_argument('--eval-steps', help='number of steps in the environment during evaluation', default=1000)
 
     parser.set_defaults(with_hindsight=False)
+    parser.set_defaults(prioritized=False)
+    parser.set_defaults(dedup_observations=False)
+    parser.set_defaults(prefetch_targets=False)
+    parser.set_defaults(env_pool=False)
+    parser.set_defaults(fused_update=False)
 
     args = vars(parser.parse_args())
     
@@ -1,4 +1,11 @@
 import numpy as np
+import os
+import json
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, ShardedMemory is unavailable
+    shared_memory = None
 from segmentTree import SumSegmentTree, MinSegmentTree
 
 # added by Olivier Sigaud --------------------------------
@@ -51,6 +58,7 @@ def array_min2d(x):
     return x.reshape(-1, 1)
 
 
+# Kept so that buffers pickled by older versions of Memory.save can still be loaded
 class ReplayBuffer(object):
     def __init__(self, limit, content_shape):
         self.contents = {}
@@ -68,55 +76,470 @@ class ReplayBuffer(object):
         return (self.contents[:self.length])
 
 
+def structured_dtype(content_shape, dtype='float32'):
+    """Row dtype of a TransitionBuffer, dtype is either shared by all fields
+    or a dict giving the dtype of some fields (float32 for the others)"""
+    if isinstance(dtype, dict):
+        return np.dtype([(name, dtype.get(name, 'float32'), shape) for name, shape in content_shape.items()])
+    return np.dtype([(name, dtype, shape) for name, shape in content_shape.items()])
+
+
+def grow_array(array, size, limit, initial_size=1024):
+    """Return array, or a copy of it extended with zeros, with at least min(size, limit) rows.
+    The number of rows grows geometrically, starting from initial_size and never exceeding limit."""
+    size = min(size, limit)
+    capacity = len(array)
+    if size <= capacity:
+        return array
+    capacity = max(capacity, min(initial_size, limit))
+    while capacity < size:
+        capacity *= 2
+    grown = np.zeros((min(capacity, limit),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class TransitionBuffer(object):
+    def __init__(self, limit, content_shape, dtype='float32'):
+        """Ring buffer storing every field of a transition in a single structured array,
+        so that a minibatch is gathered with one index computation and one copy.
+        The array grows geometrically with the content until it reaches limit rows,
+        the buffer only starts overwriting its oldest rows after that."""
+        self.limit = limit
+        self.start = 0
+        self.length = 0
+        self.nb_appended = 0  # total number of transitions ever written
+        self.names = list(content_shape.keys())
+        self.dtype = structured_dtype(content_shape, dtype)
+        self.data = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return self.length
+
+    def field_shape(self, name):
+        return self.dtype[name].shape
+
+    def reserve(self, size):
+        """Make sure the slots below min(size, limit) are allocated"""
+        # Until the buffer is full start is 0, so the slots in use are the first length ones
+        self.data = grow_array(self.data, size, self.limit)
+
+    def append(self, buffer_item):
+        """Write one transition, returns the slot it was written to"""
+        self.reserve(self.length + 1)
+        slot = (self.start + self.length) % self.limit
+        for name in self.names:
+            self.data[name][slot] = np.reshape(buffer_item[name], self.field_shape(name))
+        if self.length < self.limit:
+            self.length += 1
+        else:
+            self.start = (self.start + 1) % self.limit
+        self.nb_appended += 1
+        return slot
+
+    def append_many(self, buffer_items):
+        """Write a dict of (N, ...) arrays in one go, returns the slots written to"""
+        n = len(buffer_items[self.names[0]])
+        skip = max(0, n - self.limit)
+        self.reserve(self.length + n)
+        slots = (self.start + self.length + np.arange(skip, n)) % self.limit
+        for name in self.names:
+            values = np.reshape(buffer_items[name], (n,) + self.field_shape(name))
+            self.data[name][slots] = values[skip:]
+        overflow = max(0, self.length + n - self.limit)
+        self.length = min(self.length + n, self.limit)
+        self.start = (self.start + overflow) % self.limit
+        self.nb_appended += n
+        return slots
+
+    def last_slots(self, n):
+        """Slots of the n most recently written transitions, oldest first"""
+        n = min(n, self.length)
+        return (self.start + self.length - n + np.arange(n)) % self.limit
+
+    def get_slots(self, slots):
+        """Gather the rows stored at the given slots, returns a dict of (N, ...) arrays"""
+        batch = self.data[slots]
+        return {name: batch[name] for name in self.names}
+
+    def get_batch(self, idxs):
+        return self.get_slots((self.start + idxs) % self.limit)
+
+    def dump(self):
+        """Get all of the data in a single array, oldest first"""
+        return self.data[(self.start + np.arange(self.length)) % self.limit]
+
+    @staticmethod
+    def from_replay_buffer(buffer):
+        """Convert a legacy ReplayBuffer (as pickled by older versions of Memory.save)"""
+        content_shape = {name: ring.data.shape[1:] for name, ring in buffer.contents.items()}
+        length = len(next(iter(buffer.contents.values())))
+        new_buffer = TransitionBuffer(next(iter(buffer.contents.values())).maxlen, content_shape)
+        new_buffer.append_many({name: ring.get_batch(np.arange(length))
+                                for name, ring in buffer.contents.items()})
+        return new_buffer
+
+
+class MemmapTransitionBuffer(TransitionBuffer):
+    def __init__(self, limit, content_shape, directory, dtype='float32'):
+        """TransitionBuffer whose rows live in np.memmap files under directory.
+
+        start, length and nb_appended are kept in a small memmapped header so that other
+        processes opening the same directory see the live content of the buffer.
+        """
+        self.limit = limit
+        self.names = list(content_shape.keys())
+        self.dtype = structured_dtype(content_shape, dtype)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'meta.json'), 'w') as fd:
+            json.dump({'limit': limit,
+                       'fields': [[name, self.dtype[name].base.str, list(self.field_shape(name))]
+                                  for name in self.names]}, fd)
+        self.header = np.memmap(os.path.join(directory, 'header.dat'), dtype='int64', mode='w+', shape=(3,))
+        self.data = np.memmap(os.path.join(directory, 'transitions.dat'), dtype=self.dtype, mode='w+',
+                              shape=(limit,))
+
+    @staticmethod
+    def open(directory, mode='r+'):
+        """Reopen a buffer written by another MemmapTransitionBuffer, use mode='r' for read-only access"""
+        with open(os.path.join(directory, 'meta.json'), 'r') as fd:
+            meta = json.load(fd)
+        buffer = MemmapTransitionBuffer.__new__(MemmapTransitionBuffer)
+        buffer.limit = meta['limit']
+        buffer.names = [name for name, _, _ in meta['fields']]
+        buffer.dtype = np.dtype([(name, dtype, tuple(shape)) for name, dtype, shape in meta['fields']])
+        buffer.directory = directory
+        buffer.header = np.memmap(os.path.join(directory, 'header.dat'), dtype='int64', mode=mode, shape=(3,))
+        buffer.data = np.memmap(os.path.join(directory, 'transitions.dat'), dtype=buffer.dtype, mode=mode,
+                                shape=(buffer.limit,))
+        return buffer
+
+    def reserve(self, size):
+        # The files are created at full size, the OS only allocates the pages that are written
+        pass
+
+    @property
+    def start(self):
+        return int(self.header[0])
+
+    @start.setter
+    def start(self, value):
+        self.header[0] = value
+
+    @property
+    def length(self):
+        return int(self.header[1])
+
+    @length.setter
+    def length(self, value):
+        self.header[1] = value
+
+    @property
+    def nb_appended(self):
+        return int(self.header[2])
+
+    @nb_appended.setter
+    def nb_appended(self, value):
+        self.header[2] = value
+
+    def sync(self):
+        """Write the pending changes to disk"""
+        self.data.flush()
+        self.header.flush()
+
+
+class SharedTransitionBuffer(TransitionBuffer):
+    def __init__(self, limit, content_shape, nb_shards, dtype='float32'):
+        """TransitionBuffer living in multiprocessing shared memory, split into nb_shards
+        shards that each have a single writer process (see set_shard).
+
+        A writer fills its shard as a ring and publishes each row by incrementing the shard
+        counter once the row is written, so neither writers nor readers take a lock.
+        A row being overwritten in a full shard may be read while it is written.
+        The buffer is attached to the same segments when pickled to a child process,
+        the creating process owns them and unlinks them on close.
+        """
+        self.nb_shards = nb_shards
+        self.shard_size = limit // nb_shards
+        self.limit = self.shard_size * nb_shards
+        self.names = list(content_shape.keys())
+        self.dtype = structured_dtype(content_shape, dtype)
+        self.shard = None
+        self._owner = True
+        self._data_shm = shared_memory.SharedMemory(create=True, size=self.limit * self.dtype.itemsize)
+        self._counts_shm = shared_memory.SharedMemory(create=True, size=8 * nb_shards)
+        self._map()
+        self.data[:] = np.zeros(1, dtype=self.dtype)
+        self.counts[:] = 0
+
+    def _map(self):
+        self.data = np.ndarray((self.limit,), dtype=self.dtype, buffer=self._data_shm.buf)
+        self.counts = np.ndarray((self.nb_shards,), dtype='int64', buffer=self._counts_shm.buf)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['data', 'counts', '_data_shm', '_counts_shm']:
+            del state[key]
+        state['_data_name'] = self._data_shm.name
+        state['_counts_name'] = self._counts_shm.name
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        data_name = state.pop('_data_name')
+        counts_name = state.pop('_counts_name')
+        self.__dict__.update(state)
+        self._data_shm = shared_memory.SharedMemory(name=data_name)
+        self._counts_shm = shared_memory.SharedMemory(name=counts_name)
+        self._map()
+
+    def set_shard(self, shard):
+        """Select the shard written by this process"""
+        assert 0 <= shard < self.nb_shards
+        self.shard = shard
+
+    @property
+    def start(self):
+        return 0
+
+    @property
+    def length(self):
+        return int(np.minimum(self.counts, self.shard_size).sum())
+
+    @property
+    def nb_appended(self):
+        return int(self.counts.sum())
+
+    def append(self, buffer_item):
+        count = self.counts[self.shard]
+        slot = self.shard * self.shard_size + count % self.shard_size
+        for name in self.names:
+            self.data[name][slot] = np.reshape(buffer_item[name], self.field_shape(name))
+        self.counts[self.shard] = count + 1
+        return slot
+
+    def append_many(self, buffer_items):
+        n = len(buffer_items[self.names[0]])
+        skip = max(0, n - self.shard_size)
+        count = self.counts[self.shard]
+        slots = self.shard * self.shard_size + (count + np.arange(skip, n)) % self.shard_size
+        for name in self.names:
+            values = np.reshape(buffer_items[name], (n,) + self.field_shape(name))
+            self.data[name][slots] = values[skip:]
+        self.counts[self.shard] = count + n
+        return slots
+
+    def _filled_slots(self, idxs):
+        """Map indices in [0, len(self)) to the slots of the filled part of each shard"""
+        fills = np.minimum(self.counts, self.shard_size)
+        ends = np.cumsum(fills)
+        shards = np.searchsorted(ends, idxs, side='right')
+        return shards * self.shard_size + idxs - (ends - fills)[shards]
+
+    def get_batch(self, idxs):
+        return self.get_slots(self._filled_slots(idxs))
+
+    def last_slots(self, n):
+        raise NotImplementedError('shards are written concurrently, there is no global write order')
+
+    def dump(self):
+        """Get all of the data in a single array, shard by shard"""
+        return self.data[self._filled_slots(np.arange(len(self)))]
+
+    def close(self):
+        """Detach from the shared segments, and free them in the creating process"""
+        del self.data, self.counts
+        self._data_shm.close()
+        self._counts_shm.close()
+        if self._owner:
+            self._data_shm.unlink()
+            self._counts_shm.unlink()
+
+
+# Field dtypes of each storage policy, the other fields are stored as float32.
+# Float16 rewards are stored without their terminal bonus TERMINAL_REWARD * terminal1,
+# which would leave no precision for the control cost, and get it back when decoded.
+STORAGE_POLICIES = {'float32': {},
+                    'float16': {'state0': 'float16',
+                                'action': 'float16',
+                                'state1': 'float16',
+                                'terminal1': 'uint8'},
+                    'quantized': {'state0': 'float16',
+                                  'action': 'float16',
+                                  'reward': 'float16',
+                                  'state1': 'float16',
+                                  'terminal1': 'uint8'}}
+TERMINAL_REWARD = 100
+
+
+def manceron_chunks(file, chunk_size=100000):
+    """Read a buffer pickled under Pierre Manceron's format (a list of
+    (state0, action, reward, state1, terminal1) tuples), and yield it as dicts of arrays
+    of at most chunk_size transitions, with the position shifted by -0.5"""
+    with open(file, "rb") as fd:
+        manceron_memory = pickle.load(fd)
+
+    for start in range(0, len(manceron_memory), chunk_size):
+        state0, action, reward, state1, terminal1 = zip(*manceron_memory[start:start + chunk_size])
+        chunk = {'state0': np.array(state0, dtype='float32'),
+                 'action': np.array(action, dtype='float32'),
+                 'reward': np.array(reward, dtype='float32'),
+                 'state1': np.array(state1, dtype='float32'),
+                 'terminal1': np.array(terminal1, dtype='float32')}
+        chunk['state0'][:, 0] -= 0.5
+        chunk['state1'][:, 0] -= 0.5
+        yield chunk
+
+
+def decode_stored(chunk):
+    """Convert a chunk read from a buffer of any storage policy back to float32,
+    the policy being recognized from the dtypes: float16 rewards lack their terminal bonus"""
+    result = {}
+    for name, values in chunk.items():
+        result[name] = values.astype('float32', copy=False)
+    if 'reward' in chunk and chunk['reward'].dtype == np.float16:
+        result['reward'] = result['reward'] + TERMINAL_REWARD * result['terminal1']
+    return result
+
+
+def stored_chunks(buffer, chunk_size=100000):
+    """Yield the content of a TransitionBuffer or legacy ReplayBuffer oldest first,
+    decoded to float32, as dicts of arrays of at most chunk_size transitions"""
+    if isinstance(buffer, ReplayBuffer):
+        length = len(next(iter(buffer.contents.values())))
+        for start in range(0, length, chunk_size):
+            idxs = np.arange(start, min(start + chunk_size, length))
+            yield decode_stored({name: ring.get_batch(idxs) for name, ring in buffer.contents.items()})
+    else:
+        for start in range(0, len(buffer), chunk_size):
+            yield decode_stored(buffer.get_batch(np.arange(start, min(start + chunk_size, len(buffer)))))
+
+
+def pickled_memory_chunks(file, chunk_size=100000):
+    """Read a buffer pickled by Memory.save with any storage policy, and yield its content
+    oldest first as float32 dicts of arrays of at most chunk_size transitions"""
+    with open(file, "rb") as fd:
+        buffer = pickle.load(fd)
+
+    for chunk in stored_chunks(buffer, chunk_size):
+        yield chunk
+
+
 class Memory():
-    def __init__(self, env_wrapper, with_reward, limit):
+    def __init__(self, env_wrapper, with_reward, limit, directory=None, storage='float32'):
+        """Transition replay buffer, kept in RAM unless a directory is given,
+        in which case the transitions are stored in memory-mapped files there.
+        storage is one of STORAGE_POLICIES, minibatches are always returned as float32."""
+
+        self.storage = storage
+        contents = self._contents(env_wrapper, with_reward)
+        self.buffer = self._make_buffer(limit, contents, directory)
+        self.with_reward = with_reward
+        self.env_wrapper = env_wrapper
+
+        # Incremental checkpointing
+        self._checkpointed = 0
+        self._chunks = []
+        self._chunk_rows = 0
+        self._chunk_id = 0
 
+    def _make_buffer(self, limit, contents, directory):
+        if directory is None:
+            return TransitionBuffer(limit, contents, self._dtypes())
+        return MemmapTransitionBuffer(limit, contents, directory, self._dtypes())
+
+    def _contents(self, env_wrapper, with_reward):
+        """Shapes of the fields stored for each transition"""
         if with_reward:
             contents = {'state0': env_wrapper.state_shape,
                         'action': env_wrapper.action_shape,
-                        'state1': env_wrapper.state_shape,
                         'reward': env_wrapper.reward_shape,
+                        'state1': env_wrapper.state_shape,
                         'terminal1': env_wrapper.terminal_shape}
         else:
             contents = {'state0': env_wrapper.state_shape,
                         'action': env_wrapper.action_shape,
                         'state1': env_wrapper.state_shape}
+        return contents
 
-        self.buffer = ReplayBuffer(limit, contents)
-        self.with_reward = with_reward
-        self.env_wrapper = env_wrapper
+    def _dtypes(self):
+        """Dtypes of the fields that are not stored as float32"""
+        return dict(STORAGE_POLICIES[self.storage])
+
+    def _encode(self, buffer_items):
+        """Remove the terminal bonus from the rewards if they are stored as float16"""
+        if self.with_reward and 'reward' in STORAGE_POLICIES[self.storage]:
+            terminals = np.reshape(buffer_items['terminal1'], np.shape(buffer_items['reward']))
+            rewards = np.asarray(buffer_items['reward'], dtype='float64') - TERMINAL_REWARD * (terminals > 0)
+            buffer_items = dict(buffer_items, reward=rewards)
+        return buffer_items
+
+    def _decode(self, result):
+        """Convert the fields stored with a reduced precision back to float32"""
+        for name in STORAGE_POLICIES[self.storage]:
+            if name in result:
+                result[name] = result[name].astype('float32')
+        if 'reward' in STORAGE_POLICIES[self.storage] and 'reward' in result:
+            result['reward'] += TERMINAL_REWARD * result['terminal1']
+        return result
+
+    def memory_usage(self):
+        """Bytes currently allocated for each field of the buffer"""
+        usage = {name: self.buffer.dtype[name].itemsize * len(self.buffer.data) for name in self.buffer.names}
+        usage['total'] = self.buffer.dtype.itemsize * len(self.buffer.data)
+        return usage
 
     def size(self):
-        return self.buffer.length
+        return len(self.buffer)
+
+    def _evaluate(self, result):
+        """Fill in the rewards and terminals of a minibatch from its states"""
+        rewards, terminals = self.env_wrapper.evaluate_transitions(result['state0'],
+                                                                   result['action'],
+                                                                   result['state1'])
+        result['reward'] = np.reshape(rewards, (-1, 1)).astype('float32')
+        result['terminal1'] = np.reshape(terminals, (-1, 1)).astype('float32')
+        return result
 
     def sample(self, batch_size):
-        # Draw such that we always have a proceeding element.
-        batch_idxs = np.random.random_integers(self.nb_entries - 2, size=batch_size)
-        result = {}
-        for name, value in self.buffer.contents.items():
-            result[name] = array_min2d(value.get_batch(batch_idxs))
+        batch_idxs = np.random.randint(self.nb_entries, size=batch_size)
+        result = self._decode(self.buffer.get_batch(batch_idxs))
         if not self.with_reward:
-            result['rewards'], result['terminals1'] = \
-                self.env_wrapper.evaluate_transition(result['state0'],
-                                                     result['action'],
-                                                     result['state1'])
+            self._evaluate(result)
 
         return result
 
     def append(self, buffer_item, training=True):
         if not training:
             return
-        self.buffer.append(buffer_item)
+        self._store(buffer_item)
+
+    def append_many(self, buffer_items, training=True):
+        if not training:
+            return
+        self._store_many(buffer_items)
+
+    def flush(self):
+        """Called at the end of each episode, nothing to do for a plain replay buffer"""
+        pass
+
+    def _store(self, buffer_item):
+        """Write a transition to the buffer, returns its slot"""
+        return self.buffer.append(self._encode(buffer_item))
+
+    def _store_many(self, buffer_items):
+        """Write a batch of transitions to the buffer, returns their slots"""
+        return self.buffer.append_many(self._encode(buffer_items))
 
     @property
     def nb_entries(self):
-        return len(self.buffer.contents['state0'])
+        return len(self.buffer)
 
     # added by Olivier Sigaud --------------------------------
 
     def rewards(self):
-        vec = self.buffer.contents
-        return vec['reward'].data
+        return self._decode(self.buffer.get_batch(np.arange(self.nb_entries)))['reward']
 
     # maybe add the other accessors
 
@@ -127,12 +550,11 @@ class Memory():
         plt.ylabel("velocity")
         plt.title("Content of the replay buffer")
 
-        vec = self.buffer.contents
+        contents = self._decode(self.buffer.get_batch(np.arange(self.nb_entries)))
 
-        states = vec['state0'].data
-        rewards = vec['reward'].data
+        states = contents['state0']
+        rewards = contents['reward'][:, 0]
 
-        states = np.array(states)
         plt.set_cmap('jet')
         plt.scatter(states[:, 0], states[:, 1], s=1, c=rewards)
         plt.colorbar(label="rewards")
@@ -140,8 +562,11 @@ class Memory():
 
     # warning: only saves the content, does not save the parameters such as size_limit, etc.
     def save(self, file):
-        """Dump the memory into a pickle file"""
+        """Dump the memory into a pickle file, memory-mapped buffers are only synced to their directory"""
         print("Saving memory")
+        if isinstance(self.buffer, MemmapTransitionBuffer):
+            self.buffer.sync()
+            return
         with open(file, "wb") as fd:
             pickle.dump(self.dump(), fd)
 
@@ -152,75 +577,650 @@ class Memory():
     # warning: only loads the content, does not set the parameters such as size_limit, etc.
     def load_from_file(self, file):
         with open(file, "rb") as fd:
-            self.buffer = pickle.load(fd)
+            buffer = pickle.load(fd)
+        if isinstance(buffer, ReplayBuffer):
+            buffer = TransitionBuffer.from_replay_buffer(buffer)
+        if buffer.dtype == self.buffer.dtype:
+            self.buffer = buffer
+            return
+        # Saved with another storage policy: decode, then encode with this memory's policy
+        for chunk in stored_chunks(buffer):
+            self._store_many(chunk)
+
+    def load_from_directory(self, directory, mode='r+'):
+        """Reopen a memory-mapped buffer in place, without reading its content"""
+        buffer = MemmapTransitionBuffer.open(directory, mode)
+        assert buffer.dtype == self.buffer.dtype, \
+            'the buffer in {} stores {}, this memory stores {}'.format(directory, buffer.dtype, self.buffer.dtype)
+        self.buffer = buffer
+
+    def checkpoint(self, directory):
+        """Append the transitions written since the last checkpoint to directory as a new chunk
+        Once the chunks hold more than twice the rows of the buffer, they are replaced by a single
+        full chunk, so that a full rewrite happens at most once every limit new transitions.
+        """
+        os.makedirs(directory, exist_ok=True)
+        n = min(self.buffer.nb_appended - self._checkpointed, self.buffer.limit)
+        old_chunks = []
+        if self._chunk_rows + n > 2 * self.buffer.limit:
+            old_chunks = self._chunks
+            self._chunks = []
+            self._chunk_rows = 0
+            n = len(self.buffer)
+        slots = self.buffer.last_slots(n)
+
+        chunk = 'chunk_%06d.npz' % self._chunk_id
+        arrays = self._checkpoint_state(slots)
+        np.savez(os.path.join(directory, chunk), slots=slots, rows=self.buffer.data[slots], **arrays)
+        self._chunks.append(chunk)
+        self._chunk_rows += len(slots)
+        self._chunk_id += 1
+        self._checkpointed = self.buffer.nb_appended
+
+        meta = {'class': type(self).__name__,
+                'params': self._checkpoint_params(),
+                'fields': [[name, self.buffer.dtype[name].base.str, list(self.buffer.field_shape(name))]
+                           for name in self.buffer.names],
+                'start': self.buffer.start,
+                'length': self.buffer.length,
+                'nb_appended': self.buffer.nb_appended,
+                'chunks': self._chunks,
+                'chunk_rows': self._chunk_rows,
+                'chunk_id': self._chunk_id}
+        # Replace the metadata atomically, so that a preempted checkpoint leaves the previous one usable
+        with open(os.path.join(directory, 'checkpoint.json.tmp'), 'w') as fd:
+            json.dump(meta, fd)
+        os.replace(os.path.join(directory, 'checkpoint.json.tmp'), os.path.join(directory, 'checkpoint.json'))
+        for old_chunk in old_chunks:
+            os.remove(os.path.join(directory, old_chunk))
+
+    def _checkpoint_params(self):
+        """Constructor arguments, saved with the checkpoints"""
+        return {'with_reward': self.with_reward, 'limit': self.buffer.limit, 'storage': self.storage}
+
+    def _checkpoint_state(self, slots):
+        """Extra arrays saved with the chunk holding slots"""
+        return {}
+
+    def _restore_state(self, chunk):
+        """Restore the extra arrays of a chunk, chunks are restored oldest first"""
+        pass
 
     # deals with the shift in position (substracts 0.5 to position)
     def load_from_ManceronBuffer(self, file):
         """
         used to load a replay buffer saved under Pierre Manceron's format into a replay buffer of Pierre Fournier's format
         """
-        with open(file, "rb") as fd:
-            manceron_memory = pickle.load(fd)
-
-        for idx in range(len(manceron_memory)):
-            sample = manceron_memory[idx]
-            state0 = sample[0]
-            state1 = sample[3]
-            buffer_item = {'state0': [state0[0] - 0.5, state0[1]],
-                           'action': sample[1],
-                           'reward': sample[2],
-                           'state1': [state1[0] - 0.5, state1[1]],
-                           'terminal1': sample[4]}
-            self.append(buffer_item, training=True)
+        for chunk in manceron_chunks(file):
+            self.append_many(chunk, training=True)
             # end of added by Olivier Sigaud --------------------------------
 
 
 class HerMemory(Memory):
-    def __init__(self, env_wrapper, with_reward, limit, strategy):
+    def __init__(self, env_wrapper, with_reward, limit, strategy, max_episode_steps, directory=None,
+                 storage='float32'):
         """Replay buffer that does Hindsight Experience Replay
-        obs_to_goal is a function that converts observations to goals
-        goal_slice is a slice of indices of goal in observation
+        The current episode is staged in a preallocated array of max_episode_steps + 1 rows,
+        and relabeled and written to the replay in one go by flush.
         """
-        Memory.__init__(self, env_wrapper, with_reward, limit)
+        Memory.__init__(self, env_wrapper, with_reward, limit, directory, storage)
 
         self.strategy = strategy
-        self.data = []  # stores current episode
+        # stores current episode, at full precision whatever the storage policy
+        self.data = np.zeros(max_episode_steps + 1,
+                             dtype=[(name, 'float32', self.buffer.field_shape(name)) for name in self.buffer.names])
+        self.data_length = 0
 
     def flush(self):
         """Dump the current data into the replay buffer with (final) HER"""
-        if not self.data:
+        if self.data_length == 0:
             return
 
-        state_to_goal = self.env_wrapper.state_to_goal
-        state_to_obs = self.env_wrapper.state_to_obs
-        obs_to_goal = self.env_wrapper.obs_to_goal
-
-        for buffer_item in self.data:
-            super().append(buffer_item)
+        episode = self.data[:self.data_length]
         if self.strategy == 'last':
-            final_buffer = self.data[-1]
-            _, reached = self.env_wrapper.evaluate_transition(final_buffer['state0'],
-                                                              final_buffer['action'],
-                                                              final_buffer['state1'])
-            if not reached:
-                final_state = self.data[-1]['state1']
-                new_goal = final_state[state_to_obs][obs_to_goal]
-                for buffer_item in self.data:
-                    buffer_item['state0'][state_to_goal] = new_goal
-                    buffer_item['state1'][state_to_goal] = new_goal
-                    buffer_item['reward'], buffer_item['terminal1'] = \
-                        self.env_wrapper.evaluate_transition(buffer_item['state0'],
-                                                             buffer_item['action'],
-                                                             buffer_item['state1'])
-                    super().append(buffer_item)
+            final_item = episode[-1:]
+            _, reached = self.env_wrapper.evaluate_transitions(final_item['state0'],
+                                                               final_item['action'],
+                                                               final_item['state1'])
+            if not reached[0]:
+                goal_idx = np.take(self.env_wrapper.state_to_obs, self.env_wrapper.obs_to_goal)
+                relabeled = episode.copy()
+                new_goal = final_item['state1'][0, goal_idx]
+                relabeled['state0'][:, self.env_wrapper.state_to_goal] = new_goal
+                relabeled['state1'][:, self.env_wrapper.state_to_goal] = new_goal
+                if self.with_reward:
+                    rewards, terminals = self.env_wrapper.evaluate_transitions(relabeled['state0'],
+                                                                               relabeled['action'],
+                                                                               relabeled['state1'])
+                    relabeled['reward'][:, 0] = rewards
+                    relabeled['terminal1'][:, 0] = terminals
+                episode = np.concatenate([episode, relabeled])
         else:
             print('error her strategy')
             return
-        self.data = []
+        self._store_many({name: episode[name] for name in self.buffer.names})
+        self.data_length = 0
+
+    def _checkpoint_params(self):
+        params = super()._checkpoint_params()
+        params.update(strategy=self.strategy, max_episode_steps=len(self.data) - 1)
+        return params
+
+    def _checkpoint_state(self, slots):
+        arrays = super()._checkpoint_state(slots)
+        arrays['staged'] = self.data[:self.data_length]
+        return arrays
+
+    def _restore_state(self, chunk):
+        super()._restore_state(chunk)
+        self.data_length = len(chunk['staged'])
+        self.data[:self.data_length] = chunk['staged']
+
+    def append(self, buffer_item, training=True):
+        if not training:
+            return
+        if self.data_length == len(self.data):
+            self.flush()
+        for name in self.buffer.names:
+            self.data[name][self.data_length] = np.reshape(buffer_item[name], self.buffer.field_shape(name))
+        self.data_length += 1
+
+
+class LazyHerMemory(Memory):
+    def __init__(self, env_wrapper, with_reward, limit, strategy, relabel_ratio, directory=None,
+                 storage='float32'):
+        """Replay buffer that does Hindsight Experience Replay at sampling time
+        Each transition is stored once with its episode id and its offset in the episode.
+        A fraction relabel_ratio of each minibatch gets its goal replaced by a goal achieved
+        in the same episode, chosen according to strategy:
+            'future': at this step or a later one
+            'episode': at any step of the episode
+            'final': at the last step (so far) of the episode
+        """
+        Memory.__init__(self, env_wrapper, with_reward, limit, directory, storage)
+
+        self.strategy = strategy
+        self.relabel_ratio = relabel_ratio
+        self.episode = 0
+        self.episode_step = 0
+        # Length of each episode, indexed by episode id modulo limit
+        self.episode_lengths = np.zeros(0, dtype='int64')
+
+    def _contents(self, env_wrapper, with_reward):
+        contents = Memory._contents(self, env_wrapper, with_reward)
+        contents['episode'] = ()
+        contents['offset'] = ()
+        return contents
+
+    def _dtypes(self):
+        dtypes = Memory._dtypes(self)
+        dtypes.update(episode='int64', offset='int64')
+        return dtypes
+
+    def flush(self):
+        """Start a new episode"""
+        if self.episode_step == 0:
+            return
+        self.episode += 1
+        self.episode_step = 0
+
+    def append(self, buffer_item, training=True):
+        if not training:
+            return
+        buffer_item = dict(buffer_item, episode=self.episode, offset=self.episode_step)
+        self._store(buffer_item)
+        self.episode_step += 1
+        episode_idx = self.episode % self.buffer.limit
+        self.episode_lengths = grow_array(self.episode_lengths, episode_idx + 1, self.buffer.limit)
+        self.episode_lengths[episode_idx] = self.episode_step
+
+    def append_many(self, buffer_items, training=True):
+        """Append consecutive transitions, the first one continuing the current episode.
+        As bulk sources do not call flush, a new episode starts after each terminal transition
+        and wherever a state0 does not follow the previous state1."""
+        if not training:
+            return
+        n = len(buffer_items['state0'])
+        if n == 0:
+            return
+        state0 = np.reshape(buffer_items['state0'], (n, -1)).astype('float32')
+        state1 = np.reshape(buffer_items['state1'], (n, -1)).astype('float32')
+        ends = np.ravel(buffer_items['terminal1']) > 0
+        ends[:-1] |= np.any(state1[:-1] != state0[1:], axis=1)
+
+        # Episode of each transition, and its offset from the first transition of the episode
+        new_episodes = np.concatenate([[0], np.cumsum(ends[:-1])])
+        starts = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+        offsets = np.arange(n) - starts[new_episodes]
+        offsets[new_episodes == 0] += self.episode_step
+        episodes = self.episode + new_episodes
+        self._store_many(dict(buffer_items, episode=episodes, offset=offsets))
+
+        # Only the last limit transitions are kept, the offsets give the length of their episodes so far
+        episodes, offsets = episodes[-self.buffer.limit:], offsets[-self.buffer.limit:]
+        episode_idxs = episodes % self.buffer.limit
+        self.episode_lengths = grow_array(self.episode_lengths, episode_idxs.max() + 1, self.buffer.limit)
+        self.episode_lengths[episode_idxs] = 0
+        np.maximum.at(self.episode_lengths, episode_idxs, offsets + 1)
+
+        self.episode = int(episodes[-1])
+        self.episode_step = int(offsets[-1]) + 1
+        if ends[-1]:
+            self.flush()
+
+    def _checkpoint_params(self):
+        params = super()._checkpoint_params()
+        params.update(strategy=self.strategy, relabel_ratio=self.relabel_ratio)
+        return params
+
+    def _checkpoint_state(self, slots):
+        arrays = super()._checkpoint_state(slots)
+        arrays['episode'] = self.episode
+        arrays['episode_step'] = self.episode_step
+        return arrays
+
+    def _restore_state(self, chunk):
+        super()._restore_state(chunk)
+        self.episode = int(chunk['episode'])
+        self.episode_step = int(chunk['episode_step'])
+        # Episode lengths are recovered from the offsets of the stored transitions
+        rows = chunk['rows']
+        if len(rows):
+            episode_idxs = rows['episode'] % self.buffer.limit
+            self.episode_lengths = grow_array(self.episode_lengths, episode_idxs.max() + 1, self.buffer.limit)
+            # Episodes starting in this chunk replace the older episodes sharing their index
+            self.episode_lengths[episode_idxs[rows['offset'] == 0]] = 0
+            np.maximum.at(self.episode_lengths, episode_idxs, rows['offset'] + 1)
+
+    def sample(self, batch_size):
+        batch_idxs = np.random.randint(self.nb_entries, size=batch_size)
+        slots = (self.buffer.start + batch_idxs) % self.buffer.limit
+        result = self._decode(self.buffer.get_slots(slots))
+
+        rows = np.flatnonzero(np.random.random(batch_size) < self.relabel_ratio)
+        offsets = result['offset'][rows]
+        lengths = self.episode_lengths[result['episode'][rows] % self.buffer.limit]
+        if self.strategy == 'future':
+            goal_offsets = offsets + (np.random.random(len(rows)) * (lengths - offsets)).astype('int64')
+        elif self.strategy == 'episode':
+            # The beginning of the oldest episode may have been overwritten
+            goal_offsets = (np.random.random(len(rows)) * lengths).astype('int64')
+            goal_offsets = np.maximum(goal_offsets, offsets - batch_idxs[rows])
+        elif self.strategy == 'final':
+            goal_offsets = lengths - 1
+        else:
+            print('error her strategy')
+            return result
+        goal_slots = (slots[rows] + goal_offsets - offsets) % self.buffer.limit
+
+        goal_idx = np.take(self.env_wrapper.state_to_obs, self.env_wrapper.obs_to_goal)
+        new_goals = self.buffer.data['state1'][goal_slots][:, goal_idx]
+        state_to_goal = self.env_wrapper.state_to_goal
+        result['state0'][np.ix_(rows, state_to_goal)] = new_goals
+        result['state1'][np.ix_(rows, state_to_goal)] = new_goals
+
+        return self._evaluate(result)
+
+
+class ObservationMemory(Memory):
+    def __init__(self, env_wrapper, with_reward, limit, directory=None):
+        """Replay buffer storing each observation once per time step and each goal once per episode.
+        Row t of an episode holds observation t and the transition taken from it, observation t+1
+        is read from the next row. The last observation of an episode is stored in a row without
+        transition. state0 and state1 are rebuilt from the observations and the goal at sampling time.
+        """
+        self.state_to_goal = list(getattr(env_wrapper, 'state_to_goal', []))
+        self.state_to_obs = list(getattr(env_wrapper, 'state_to_obs', range(env_wrapper.state_shape[0])))
+        Memory.__init__(self, env_wrapper, with_reward, limit, directory)
+
+        # Goals indexed by episode id modulo nb_goals, an episode with a transition uses at least two rows
+        self.nb_goals = limit // 2 + 2
+        self.goals = np.zeros((0, len(self.state_to_goal)), dtype='float32')
+        self.episode = -1
+        self.pending_slot = None  # row of the last observation of the current episode
+
+    def _contents(self, env_wrapper, with_reward):
+        contents = {'obs': (len(self.state_to_obs),),
+                    'action': env_wrapper.action_shape,
+                    'episode': (),
+                    'valid': ()}
+        if with_reward:
+            contents['reward'] = env_wrapper.reward_shape
+            contents['terminal1'] = env_wrapper.terminal_shape
+        return contents
+
+    def _dtypes(self):
+        return {'episode': 'int32', 'valid': 'uint8'}
+
+    def _new_row(self, obs):
+        return self.buffer.append({'obs': obs,
+                                   'action': 0,
+                                   'episode': self.episode,
+                                   'valid': 0,
+                                   'reward': 0,
+                                   'terminal1': 0})
 
     def append(self, buffer_item, training=True):
         if not training:
             return
-        self.data.append(buffer_item)
+        # Compare with the stored values at the stored precision
+        state0 = np.asarray(buffer_item['state0'], dtype='float32')
+        state1 = np.asarray(buffer_item['state1'], dtype='float32')
+        goal = state0[self.state_to_goal]
+        # Start a new episode if this transition does not follow the previous one
+        if self.pending_slot is None or \
+                np.any(self.buffer.data['obs'][self.pending_slot] != state0[self.state_to_obs]) or \
+                np.any(self.goals[self.episode % self.nb_goals] != goal):
+            self.episode += 1
+            self.relabel(self.episode, goal)
+            self.pending_slot = self._new_row(state0[self.state_to_obs])
+
+        slot = self.pending_slot
+        data = self.buffer.data
+        data['action'][slot] = np.reshape(buffer_item['action'], self.buffer.field_shape('action'))
+        if self.with_reward:
+            data['reward'][slot] = np.reshape(buffer_item['reward'], self.buffer.field_shape('reward'))
+            data['terminal1'][slot] = np.reshape(buffer_item['terminal1'], self.buffer.field_shape('terminal1'))
+        data['valid'][slot] = 1
+        self.pending_slot = self._new_row(state1[self.state_to_obs])
+
+    def append_many(self, buffer_items, training=True):
+        for idx in range(len(buffer_items['state0'])):
+            self.append({name: value[idx] for name, value in buffer_items.items()}, training)
+
+    def flush(self):
+        """End the current episode"""
+        self.pending_slot = None
+
+    def relabel(self, episode, goal):
+        """Replace the goal of a whole episode"""
+        self.goals = grow_array(self.goals, episode % self.nb_goals + 1, self.nb_goals)
+        self.goals[episode % self.nb_goals] = goal
+
+    def _states(self, obs, goals):
+        states = np.empty((len(obs),) + self.env_wrapper.state_shape, dtype='float32')
+        states[:, self.state_to_obs] = obs
+        states[:, self.state_to_goal] = goals
+        return states
+
+    def sample(self, batch_size):
+        # Redraw the rows that hold the last observation of an episode
+        slots = (self.buffer.start + np.random.randint(self.nb_entries, size=batch_size)) % self.buffer.limit
+        invalid = np.flatnonzero(self.buffer.data['valid'][slots] == 0)
+        while len(invalid):
+            slots[invalid] = (self.buffer.start + np.random.randint(self.nb_entries, size=len(invalid))) \
+                             % self.buffer.limit
+            invalid = invalid[self.buffer.data['valid'][slots[invalid]] == 0]
+
+        rows = self.buffer.get_slots(slots)
+        next_obs = self.buffer.data['obs'][(slots + 1) % self.buffer.limit]
+        goals = self.goals[rows['episode'] % self.nb_goals]
+        result = {'state0': self._states(rows['obs'], goals),
+                  'action': rows['action'],
+                  'state1': self._states(next_obs, goals)}
+        if self.with_reward:
+            result['reward'] = rows['reward']
+            result['terminal1'] = rows['terminal1']
+        else:
+            self._evaluate(result)
+        return result
+
+    def _checkpoint_params(self):
+        return {'with_reward': self.with_reward, 'limit': self.buffer.limit}
+
+    def _checkpoint_state(self, slots):
+        arrays = super()._checkpoint_state(slots)
+        episodes = np.union1d(self.buffer.data['episode'][slots], [self.episode])
+        episodes = episodes[episodes >= 0]
+        arrays['goal_episodes'] = episodes
+        arrays['goals'] = self.goals[episodes % self.nb_goals]
+        arrays['episode'] = self.episode
+        arrays['pending_slot'] = -1 if self.pending_slot is None else self.pending_slot
+        return arrays
+
+    def _restore_state(self, chunk):
+        super()._restore_state(chunk)
+        for episode, goal in zip(chunk['goal_episodes'], chunk['goals']):
+            self.relabel(episode, goal)
+        self.episode = int(chunk['episode'])
+        self.pending_slot = None if int(chunk['pending_slot']) < 0 else int(chunk['pending_slot'])
+
+
+class ShardedMemory(Memory):
+    def __init__(self, env_wrapper, with_reward, limit, nb_shards, storage='float32'):
+        """Replay buffer in shared memory, for nb_shards collector processes appending
+        to it while the learner samples from it.
+        Pass the memory to each collector process and call set_shard there with a distinct shard.
+        """
+        self.nb_shards = nb_shards
+        Memory.__init__(self, env_wrapper, with_reward, limit, storage=storage)
+
+    def _make_buffer(self, limit, contents, directory):
+        return SharedTransitionBuffer(limit, contents, self.nb_shards, self._dtypes())
+
+    def set_shard(self, shard):
+        self.buffer.set_shard(shard)
+
+    def checkpoint(self, directory):
+        # Incremental chunks follow the global write order, which concurrent shards do not have
+        raise NotImplementedError('checkpoints are not supported for shared-memory buffers (ShardedMemory)')
+
+    def close(self):
+        self.buffer.close()
+
+
+class StratifiedMemory(Memory):
+    def __init__(self, env_wrapper, with_reward, limit, positive_fraction, directory=None, storage='float32'):
+        """Replay buffer keeping an index of the transitions with terminal1 set (the goal was reached),
+        so that each minibatch contains a fraction positive_fraction of them when there are any.
+        Minibatches come with the importance sampling weights that correct for this stratification.
+        """
+        assert with_reward
+        Memory.__init__(self, env_wrapper, with_reward, limit, directory, storage)
+        self.positive_fraction = positive_fraction
+        self.positives = np.zeros(0, dtype='int64')  # slots of the positive transitions
+        self.nb_positives = 0
+        # Position in self.positives plus one of each slot, 0 for the other transitions
+        self.positive_index = np.zeros(0, dtype='int64')
+
+    def _index(self, slots, terminals):
+        """Update the index after the given slots have been overwritten"""
+        self.positive_index = grow_array(self.positive_index, len(self.buffer.data), self.buffer.limit)
+        terminals = np.ravel(terminals) > 0
+        for slot in np.asarray(slots)[(self.positive_index[slots] > 0) != terminals]:
+            if self.positive_index[slot] > 0:
+                # Evicted, move the last positive in its place
+                pos = self.positive_index[slot] - 1
+                last = self.positives[self.nb_positives - 1]
+                self.positives[pos] = last
+                self.positive_index[last] = pos + 1
+                self.positive_index[slot] = 0
+                self.nb_positives -= 1
+            else:
+                self.positives = grow_array(self.positives, self.nb_positives + 1, self.buffer.limit)
+                self.positives[self.nb_positives] = slot
+                self.nb_positives += 1
+                self.positive_index[slot] = self.nb_positives
+
+    def _store(self, buffer_item):
+        slot = Memory._store(self, buffer_item)
+        self._index([slot], buffer_item['terminal1'])
+        return slot
+
+    def _store_many(self, buffer_items):
+        slots = Memory._store_many(self, buffer_items)
+        terminals = np.ravel(buffer_items['terminal1'])
+        self._index(slots, terminals[len(terminals) - len(slots):])
+        return slots
+
+    def _checkpoint_params(self):
+        params = super()._checkpoint_params()
+        params.update(positive_fraction=self.positive_fraction)
+        return params
+
+    def _restore_state(self, chunk):
+        super()._restore_state(chunk)
+        self._index(chunk['slots'], chunk['rows']['terminal1'])
+
+    def sample(self, batch_size):
+        if self.nb_positives > 0:
+            nb_positives = int(round(self.positive_fraction * batch_size))
+        else:
+            nb_positives = 0
+        positive_slots = self.positives[np.random.randint(self.nb_positives, size=nb_positives)]
+        uniform_slots = (self.buffer.start + np.random.randint(self.nb_entries, size=batch_size - nb_positives)) \
+                        % self.buffer.limit
+        slots = np.concatenate([positive_slots, uniform_slots])
+        result = self._decode(self.buffer.get_slots(slots))
+
+        # Probability of each drawn transition, relative to uniform sampling
+        ratios = (batch_size - nb_positives) / batch_size * np.ones(batch_size)
+        if nb_positives > 0:
+            is_positive = self.positive_index[slots] > 0
+            ratios += is_positive * nb_positives / batch_size * self.nb_entries / self.nb_positives
+        weights = 1. / ratios
+        result['weights'] = (weights / weights.max()).reshape(-1, 1).astype('float32')
+        return result
+
+
+class PrioritizedMemory(Memory):
+    def __init__(self, env_wrapper, with_reward, limit, alpha, beta, directory=None, storage='float32'):
+        """Replay buffer that samples transitions proportionally to their TD error
+        and returns the corresponding importance sampling weights
+        alpha is the prioritization exponent, beta the importance sampling exponent
+        """
+        Memory.__init__(self, env_wrapper, with_reward, limit, directory, storage)
+        self._init_priorities(limit, alpha, beta)
+
+    def _init_priorities(self, limit, alpha, beta):
+        self.alpha = alpha
+        self.beta = beta
+
+        # Both trees are indexed by buffer slot, and grow with the buffer
+        self._it_sum = SumSegmentTree(1)
+        self._it_min = MinSegmentTree(1)
+        self._max_priority = 1.0
+        # Slots whose priority changed since the last checkpoint
+        self._dirty_priorities = np.zeros(1, dtype=bool)
+
+    def _reserve_priorities(self, size):
+        """Grow the trees to at least size leaves, keeping the current priorities"""
+        it_capacity = self._it_sum._capacity
+        if size <= it_capacity:
+            return
+        new_capacity = 2 * it_capacity
+        while new_capacity < size:
+            new_capacity *= 2
+        slots = np.arange(it_capacity)
+        sum_leaves = self._it_sum[slots]
+        min_leaves = self._it_min[slots]
+        self._it_sum = SumSegmentTree(new_capacity)
+        self._it_min = MinSegmentTree(new_capacity)
+        self._it_sum.update(slots, sum_leaves)
+        self._it_min.update(slots, min_leaves)
+        self._dirty_priorities = grow_array(self._dirty_priorities, new_capacity, new_capacity)
+
+    def _store(self, buffer_item):
+        slot = Memory._store(self, buffer_item)
+        self._reserve_priorities(len(self.buffer.data))
+        self._it_sum[slot] = self._max_priority ** self.alpha
+        self._it_min[slot] = self._max_priority ** self.alpha
+        return slot
+
+    def _store_many(self, buffer_items):
+        slots = Memory._store_many(self, buffer_items)
+        self._reserve_priorities(len(self.buffer.data))
+        priorities = np.full(len(slots), self._max_priority ** self.alpha)
+        self._it_sum.update(slots, priorities)
+        self._it_min.update(slots, priorities)
+        return slots
+
+    def _checkpoint_params(self):
+        params = super()._checkpoint_params()
+        params.update(alpha=self.alpha, beta=self.beta)
+        return params
+
+    def _checkpoint_state(self, slots):
+        arrays = super()._checkpoint_state(slots)
+        self._dirty_priorities[slots] = True
+        priority_slots = np.flatnonzero(self._dirty_priorities)
+        self._dirty_priorities[:] = False
+        arrays['priority_slots'] = priority_slots
+        arrays['priorities'] = self._it_sum[priority_slots]
+        arrays['max_priority'] = self._max_priority
+        return arrays
+
+    def _restore_state(self, chunk):
+        super()._restore_state(chunk)
+        self._reserve_priorities(len(self.buffer.data))
+        self._it_sum.update(chunk['priority_slots'], chunk['priorities'])
+        self._it_min.update(chunk['priority_slots'], chunk['priorities'])
+        self._max_priority = float(chunk['max_priority'])
+
+    def sample_proportional_slots(self, batch_size):
+        # One draw per equal-mass segment, to spread the batch over the whole distribution
+        total = self._it_sum.sum()
+        masses = (np.arange(batch_size) + np.random.random(batch_size)) * total / batch_size
+        return self._it_sum.find_prefixsum_idx(masses)
+
+    def sample(self, batch_size):
+        slots = self.sample_proportional_slots(batch_size)
+        result = self._decode(self.buffer.get_slots(slots))
+        if not self.with_reward:
+            self._evaluate(result)
+
+        total = self._it_sum.sum()
+        p_min = self._it_min.min() / total
+        max_weight = (p_min * self.nb_entries) ** (-self.beta)
+        p_samples = self._it_sum[slots] / total
+        weights = (p_samples * self.nb_entries) ** (-self.beta) / max_weight
+        result['weights'] = weights.reshape(-1, 1).astype('float32')
+        result['slots'] = slots
+        return result
+
+    def update_priorities(self, slots, td_errors, eps=1e-6):
+        """Set the priorities of the sampled slots from the TD errors of the last update"""
+        priorities = np.abs(np.ravel(td_errors)) + eps
+        self._it_sum.update(slots, priorities ** self.alpha)
+        self._it_min.update(slots, priorities ** self.alpha)
+        self._dirty_priorities[slots] = True
+        self._max_priority = max(self._max_priority, np.max(priorities))
+
+
+class PrioritizedHerMemory(PrioritizedMemory, HerMemory):
+    def __init__(self, env_wrapper, with_reward, limit, strategy, max_episode_steps, alpha, beta, directory=None,
+                 storage='float32'):
+        """Hindsight Experience Replay with prioritized sampling of the stored transitions"""
+        HerMemory.__init__(self, env_wrapper, with_reward, limit, strategy, max_episode_steps, directory, storage)
+        self._init_priorities(limit, alpha, beta)
+
+
+def load_checkpoint(directory, env_wrapper, buffer_directory=None):
+    """Rebuild the memory saved by the checkpoints in directory,
+    its buffer is memory-mapped in buffer_directory if one is given"""
+    with open(os.path.join(directory, 'checkpoint.json'), 'r') as fd:
+        meta = json.load(fd)
+    memory_class = {'Memory': Memory,
+                    'HerMemory': HerMemory,
+                    'LazyHerMemory': LazyHerMemory,
+                    'ObservationMemory': ObservationMemory,
+                    'StratifiedMemory': StratifiedMemory,
+                    'PrioritizedMemory': PrioritizedMemory,
+                    'PrioritizedHerMemory': PrioritizedHerMemory}[meta['class']]
+    memory = memory_class(env_wrapper, directory=buffer_directory, **meta['params'])
+    buffer = memory.buffer
+    buffer.reserve(meta['length'])
+    assert buffer.dtype == np.dtype([(name, dtype, tuple(shape)) for name, dtype, shape in meta['fields']])
 
+    for chunk_file in meta['chunks']:
+        with np.load(os.path.join(directory, chunk_file)) as chunk:
+            buffer.data[chunk['slots']] = chunk['rows']
+            memory._restore_state(chunk)
+    buffer.start = meta['start']
+    buffer.length = meta['length']
+    buffer.nb_appended = meta['nb_appended']
 
+    # The next checkpoint may go to another directory, so it starts over with one full chunk
+    memory._checkpointed = meta['nb_appended'] - meta['length']
+    memory._chunk_id = meta['chunk_id']
+    return memory
@@ -0,0 +1,54 @@
+import numpy as np
+import json
+
+ACTIVATIONS = {'linear': lambda x: x,
+               'relu': lambda x: np.maximum(x, 0, out=x),
+               'tanh': lambda x: np.tanh(x, out=x)}
+
+
+def save_network(filepath, inputs, layers):
+    """Write a network as an .npz file: the layer spec in json, and the weights of layer i
+    as kernel_i and bias_i.
+
+    inputs lists the names of the network inputs, the first one being fed to the first layer.
+    layers is a list of (spec, weights) pairs, spec being {'type': 'dense', 'activation': ...}
+    with weights [kernel, bias], or {'type': 'concat', 'input': name} with no weights to
+    append another input to the current activations.
+    """
+    arrays = {}
+    for i, (spec, weights) in enumerate(layers):
+        if spec['type'] == 'dense':
+            arrays['kernel_%d' % i], arrays['bias_%d' % i] = weights
+    spec = {'inputs': inputs, 'layers': [spec for spec, _ in layers]}
+    np.savez(filepath, spec=json.dumps(spec), **arrays)
+
+
+class NumpyNetwork(object):
+    def __init__(self, filepath):
+        """Forward pass of a network written by save_network, in plain numpy"""
+        with np.load(filepath) as data:
+            spec = json.loads(str(data['spec']))
+            self.inputs = spec['inputs']
+            self.layers = spec['layers']
+            self.kernels = {i: data['kernel_%d' % i].astype('float32')
+                            for i, layer in enumerate(self.layers) if layer['type'] == 'dense'}
+            self.biases = {i: data['bias_%d' % i].astype('float32')
+                           for i, layer in enumerate(self.layers) if layer['type'] == 'dense'}
+
+    def predict(self, *inputs):
+        """Evaluate a batch, inputs being (N, dim) arrays given in the order of self.inputs"""
+        assert len(inputs) == len(self.inputs)
+        named = dict(zip(self.inputs, inputs))
+        x = np.asarray(inputs[0], dtype='float32')
+        for i, layer in enumerate(self.layers):
+            if layer['type'] == 'dense':
+                x = ACTIVATIONS[layer['activation']](np.dot(x, self.kernels[i]) + self.biases[i])
+            elif layer['type'] == 'concat':
+                x = np.concatenate([x, np.asarray(named[layer['input']], dtype='float32')], axis=1)
+        return x
+
+    def predict_on_batch(self, inputs):
+        """Same call as a Keras model, inputs being an array or a list of arrays"""
+        if isinstance(inputs, (list, tuple)):
+            return self.predict(*inputs)
+        return self.predict(inputs)
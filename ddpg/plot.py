@@ -1,5 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from numpyNetwork import NumpyNetwork
 # import seaborn as sb
 # from stats import network_values
 
@@ -7,21 +8,29 @@ import matplotlib.pyplot as plt
 # e.g. a meshgrid
 
 
+def grid_states(env, definition):
+    """The definition x definition grid of states covering the observation space, as a batch,
+    ordered so that the predictions reshape to the portrait matrix (top row at the highest y)"""
+    x_min, y_min = env.observation_space.low
+    x_max, y_max = env.observation_space.high
+    xs, ys = np.meshgrid(np.linspace(x_min, x_max, num=definition), np.linspace(y_max, y_min, num=definition))
+    return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+
 def portrait_actor(actor, env, figure=None, definition=50, plot=True, save_figure=False, figure_file="actor.png"):
-    """Portrait the actor"""
+    """Portrait the actor, a Keras model, a NumpyNetwork or the path of an exported actor"""
+    if isinstance(actor, str):
+        actor = NumpyNetwork(actor)
     #if env.observation_space.dim != 2:
        # raise(ValueError("The provided environment has an observation space of dimension {}, whereas it should be 2".format(env.observation_space.dim)))
 
-    portrait = np.zeros((definition, definition))
     x_min, y_min = env.observation_space.low
     x_max, y_max = env.observation_space.high
     # Use the dimension names if given otherwise default to "x" and "y"
     x_label, y_label = getattr(env.observation_space, "names", ["x", "y"])
 
-    for index_x, x in enumerate(np.linspace(x_min, x_max, num=definition)):
-        for index_y, y in enumerate(np.linspace(y_min, y_max, num=definition)):
-            # Be careful to fill the matrix in the right order
-            portrait[definition - (1 + index_y), index_x] = actor.predict(np.array([[x, y]]))
+    # The whole grid in one batch
+    portrait = np.reshape(actor.predict(grid_states(env, definition)), (definition, definition))
     if plot or save_figure:
         if figure is None:
             plt.figure(figsize=(10, 10))
@@ -39,18 +48,20 @@ def portrait_actor(actor, env, figure=None, definition=50, plot=True, save_figur
 
 
 def portrait_critic(critic, env, figure=None, definition=50, plot=True, action=[-1], save_figure=False, figure_file="critic.png"):
+    """Portrait the critic at a fixed action, critic being a Keras model, a NumpyNetwork or the path of an exported critic"""
+    if isinstance(critic, str):
+        critic = NumpyNetwork(critic)
     #if env.observation_space.dim != 2:
         #raise(ValueError("The provided environment has an observation space of dimension {}, whereas it should be 2".format(env.observation_space.dim)))
 
-    portrait = np.zeros((definition, definition))
     x_min, y_min = env.observation_space.low
     x_max, y_max = env.observation_space.high
     x_label, y_label = getattr(env.observation_space, "names", ["x", "y"])
 
-    for index_x, x in enumerate(np.linspace(x_min, x_max, num=definition)):
-        for index_y, y in enumerate(np.linspace(y_min, y_max, num=definition)):
-            # Be careful to fill the matrix in the right order
-            portrait[definition - (1 + index_y), index_x] = critic.predict_on_batch([np.array([[x, y]]), np.array(action)])
+    # The whole grid in one batch
+    states = grid_states(env, definition)
+    actions = np.tile(action, (len(states), 1))
+    portrait = np.reshape(critic.predict_on_batch([states, actions]), (definition, definition))
     if plot or save_figure:
         if figure is None:
             figure = plt.figure(figsize=(10, 10))
@@ -68,6 +79,8 @@ def portrait_critic(critic, env, figure=None, definition=50, plot=True, action=[
 
 
 def plot_trajectory(trajectory, actor, env, figure=None, figure_file="trajectory.png", definition=50, plot=True, save_figure=False,):
+    if isinstance(actor, str):
+        actor = NumpyNetwork(actor)
     if figure is None:
         plt.figure(figsize=(10, 10))
     plt.scatter(trajectory["x"], trajectory["y"], c=range(1, len(trajectory["x"]) + 1))
@@ -77,16 +90,13 @@ def plot_trajectory(trajectory, actor, env, figure=None, figure_file="trajectory
         raise(ValueError("The provided environment has an observation space of dimension {}, whereas it should be 2".format(env.observation_space.dim)))
 
     # Add the actor phase portrait
-    portrait = np.zeros((definition, definition))
     x_min, y_min = env.observation_space.low
     x_max, y_max = env.observation_space.high
     # Use the dimension names if given otherwise default to "x" and "y"
     x_label, y_label = getattr(env.observation_space, "names", ["x", "y"])
 
-    for index_x, x in enumerate(np.linspace(x_min, x_max, num=definition)):
-        for index_y, y in enumerate(np.linspace(y_min, y_max, num=definition)):
-            # Be careful to fill the matrix in the right order
-            portrait[definition - (1 + index_y), index_x] = actor.predict(np.array([[x, y]]))
+    # The whole grid in one batch
+    portrait = np.reshape(actor.predict(grid_states(env, definition)), (definition, definition))
 
     # TODO: Use the `corner` parameter
     plt.imshow(portrait, cmap="inferno", extent=[x_min, x_max, y_min, y_max], aspect='auto')
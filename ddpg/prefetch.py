@@ -0,0 +1,105 @@
+import threading
+import queue
+import time
+
+
+class Prefetcher(object):
+    def __init__(self, memory, batch_size, queue_size=4, max_staleness=None, actor=None):
+        """Wraps a memory and samples its minibatches in a background thread.
+
+        sample only dequeues a ready minibatch, and drops the ones drawn more than
+        max_staleness appends ago (None to keep them all).
+        If actor is given, the target actions on state1 are computed by the thread as well
+        and returned as 'target_action', with the target network of when the batch was drawn.
+        Writes to the memory go through this object, so that they never interleave with a draw.
+        Every other attribute is read from the wrapped memory.
+        An exception raised in the thread is raised again by sample.
+        """
+        self.memory = memory
+        self.batch_size = batch_size
+        self.max_staleness = max_staleness
+        self.actor = actor
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.memory, name)
+
+    def _run(self):
+        try:
+            if self.actor is not None:
+                # Keras models can only be called from threads that use their graph
+                with self.actor.sess.graph.as_default():
+                    self._fill()
+            else:
+                self._fill()
+        except Exception as error:
+            # Passed on to sample, which would otherwise wait forever
+            self._put((None, error))
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+    def _fill(self):
+        while not self.stopped.is_set():
+            with self.lock:
+                nb_entries = self.memory.nb_entries
+                if nb_entries >= self.batch_size:
+                    samples = self.memory.sample(self.batch_size)
+                    nb_appended = self._nb_appended()
+            if nb_entries < self.batch_size:
+                time.sleep(0.01)
+                continue
+            if self.actor is not None:
+                samples['target_action'] = self.actor.predict_target(samples['state1'])
+            self._put((nb_appended, samples))
+
+    def _nb_appended(self):
+        # Read-only memories such as OfflineMemory have no ring buffer, their batches never get stale
+        if hasattr(self.memory, 'buffer'):
+            return self.memory.buffer.nb_appended
+        return 0
+
+    def sample(self, batch_size):
+        assert batch_size == self.batch_size
+        while True:
+            nb_appended, samples = self.queue.get()
+            if nb_appended is None:
+                # The thread has stopped on this exception, keep it for the next calls
+                self.queue.put((None, samples))
+                raise samples
+            if self.max_staleness is None or self._nb_appended() - nb_appended <= self.max_staleness:
+                return samples
+
+    def append(self, buffer_item, training=True):
+        with self.lock:
+            self.memory.append(buffer_item, training)
+
+    def append_many(self, buffer_items, training=True):
+        with self.lock:
+            self.memory.append_many(buffer_items, training)
+
+    def flush(self):
+        with self.lock:
+            self.memory.flush()
+
+    def update_priorities(self, slots, td_errors):
+        with self.lock:
+            self.memory.update_priorities(slots, td_errors)
+
+    def checkpoint(self, directory):
+        with self.lock:
+            self.memory.checkpoint(directory)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
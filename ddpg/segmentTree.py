@@ -1,4 +1,4 @@
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -17,12 +17,16 @@ class SegmentTree(object):
                a contiguous subsequence of items in the
                array.
 
+        The tree is stored in a flat NumPy array (node i has children 2i and 2i+1,
+        leaves start at index capacity), so that reads and updates of a whole batch
+        of leaves are done level by level with array operations.
+
         Paramters
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            and operation for combining elements (eg. sum, max)
+        operation: numpy ufunc
+            and operation for combining elements (eg. np.add, np.maximum)
             must for a mathematical group together with the set of
             possible values for array elements.
         neutral_element: obj
@@ -31,23 +35,9 @@ class SegmentTree(object):
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype='float64')
         self._operation = operation
-
-    def _reduce_helper(self, start, end, node, node_start, node_end):
-        if start == node_start and end == node_end:
-            return self._value[node]
-        mid = (node_start + node_end) // 2
-        if end <= mid:
-            return self._reduce_helper(start, end, 2 * node, node_start, mid)
-        else:
-            if mid + 1 <= start:
-                return self._reduce_helper(start, end, 2 * node + 1, mid + 1, node_end)
-            else:
-                return self._operation(
-                    self._reduce_helper(start, mid, 2 * node, node_start, mid),
-                    self._reduce_helper(mid + 1, end, 2 * node + 1, mid + 1, node_end)
-                )
+        self._neutral_element = neutral_element
 
     def reduce(self, start=0, end=None):
         """Returns result of applying `self.operation`
@@ -71,23 +61,39 @@ class SegmentTree(object):
             end = self._capacity
         if end < 0:
             end += self._capacity
-        end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        if start == 0 and end == self._capacity:
+            return float(self._value[1])
+        # Bottom-up walk over the half-open leaf range [start, end)
+        result = self._neutral_element
+        start += self._capacity
+        end += self._capacity
+        while start < end:
+            if start & 1:
+                result = self._operation(result, self._value[start])
+                start += 1
+            if end & 1:
+                end -= 1
+                result = self._operation(result, self._value[end])
+            start //= 2
+            end //= 2
+        return float(result)
+
+    def update(self, idxs, values):
+        """Set the leaves idxs to values, then recompute all their ancestors level by level"""
+        nodes = np.asarray(idxs, dtype='int64').ravel() + self._capacity
+        if nodes.size == 0:
+            return
+        self._value[nodes] = np.ravel(values)
+        nodes //= 2
+        while nodes[0] >= 1:
+            self._value[nodes] = self._operation(self._value[2 * nodes], self._value[2 * nodes + 1])
+            nodes //= 2
 
     def __setitem__(self, idx, val):
-        # index of the leaf
-        idx += self._capacity
-        self._value[idx] = val
-        idx //= 2
-        while idx >= 1:
-            self._value[idx] = self._operation(
-                self._value[2 * idx],
-                self._value[2 * idx + 1]
-            )
-            idx //= 2
+        self.update(np.atleast_1d(idx), np.broadcast_to(val, np.shape(np.atleast_1d(idx))))
 
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
+        assert np.all(0 <= np.asarray(idx)) and np.all(np.asarray(idx) < self._capacity)
         return self._value[self._capacity + idx]
 
 
@@ -95,7 +101,7 @@ class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -113,30 +119,36 @@ class SumSegmentTree(SegmentTree):
 
         Parameters
         ----------
-        perfixsum: float
+        perfixsum: float or array of floats
             upperbound on the sum of array prefix
 
         Returns
         -------
-        idx: int
+        idx: int or array of ints
             highest index satisfying the prefixsum constraint
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        prefixsum = np.array(prefixsum, dtype='float64')
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        scalar = prefixsum.ndim == 0
+        prefixsum = np.atleast_1d(prefixsum)
+        idx = np.ones(prefixsum.shape, dtype='int64')
+        while idx[0] < self._capacity:  # while non-leaf, all nodes are at the same depth
+            left = 2 * idx
+            left_value = self._value[left]
+            go_right = left_value <= prefixsum
+            prefixsum -= np.where(go_right, left_value, 0.0)
+            idx = left + go_right
+        idx -= self._capacity
+        if scalar:
+            return int(idx[0])
+        return idx
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
@@ -0,0 +1,68 @@
+import numpy as np
+import os
+from envWrapper import NoGoal
+from memory import Memory, LazyHerMemory, load_checkpoint
+
+
+def transitions(n, start):
+    steps = np.arange(start, start + n)
+    return {'state0': np.stack([steps, -steps], axis=1).astype('float32'),
+            'action': np.reshape(steps % 7, (n, 1)).astype('float32'),
+            'reward': np.reshape(steps % 5 == 0, (n, 1)).astype('float32'),
+            'state1': np.stack([steps + 1, -steps - 1], axis=1).astype('float32'),
+            'terminal1': np.reshape(steps % 5 == 0, (n, 1)).astype('float32')}
+
+
+def append_episodes(memory, items):
+    for k in range(len(items['reward'])):
+        memory.append({name: values[k] for name, values in items.items()})
+        if items['terminal1'][k]:
+            memory.flush()
+
+
+def assert_same_contents(memory, loaded):
+    assert loaded.nb_entries == memory.nb_entries
+    assert loaded.buffer.nb_appended == memory.buffer.nb_appended
+    slots = memory.buffer.last_slots(memory.nb_entries)
+    np.testing.assert_array_equal(loaded.buffer.data[slots], memory.buffer.data[slots])
+
+
+def test_chunks_follow_new_data_after_wrap(tmpdir):
+    directory = str(tmpdir.join('checkpoint'))
+    memory = Memory(NoGoal(), with_reward=True, limit=100)
+    memory.append_many(transitions(150, 0))
+    memory.checkpoint(directory)
+    appended = 150
+    sizes = []
+    for k in range(30):
+        memory.append_many(transitions(10, appended))
+        appended += 10
+        memory.checkpoint(directory)
+        with np.load(os.path.join(directory, memory._chunks[-1])) as chunk:
+            sizes.append(len(chunk['slots']))
+        assert memory._chunk_rows <= 2 * memory.buffer.limit
+        assert len([f for f in os.listdir(directory) if f.endswith('.npz')]) == len(memory._chunks)
+        assert_same_contents(memory, load_checkpoint(directory, NoGoal()))
+
+    # Only one full rewrite every limit new rows, the other chunks hold the new rows only
+    assert sizes.count(memory.buffer.limit) <= 3
+    assert sizes.count(10) >= len(sizes) - 3
+
+
+def test_checkpoint_into_new_directory_after_load(tmpdir):
+    memory = LazyHerMemory(NoGoal(), with_reward=True, limit=100, strategy='final', relabel_ratio=0.5)
+    appended = 0
+    for k in range(25):
+        append_episodes(memory, transitions(10, appended))
+        appended += 10
+        memory.checkpoint(str(tmpdir.join('first')))
+
+    loaded = load_checkpoint(str(tmpdir.join('first')), NoGoal())
+    episode_idxs = memory.buffer.data['episode'] % memory.buffer.limit
+    np.testing.assert_array_equal(loaded.episode_lengths[episode_idxs], memory.episode_lengths[episode_idxs])
+    for k in range(25):
+        append_episodes(loaded, transitions(10, appended))
+        append_episodes(memory, transitions(10, appended))
+        appended += 10
+        loaded.checkpoint(str(tmpdir.join('second')))
+        assert_same_contents(memory, load_checkpoint(str(tmpdir.join('second')), NoGoal()))
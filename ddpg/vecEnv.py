@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class VecMountainCar(object):
+    def __init__(self, nb_envs, seed=None):
+        """N independent MountainCarContinuous-v0 cars, stepped together as array operations.
+
+        Observations are (N, 2) arrays of positions and velocities, actions are (N, 1) arrays.
+        reset(mask) only resets the cars selected by the boolean mask, so that finished
+        episodes can be restarted without touching the others.
+        """
+        self.nb_envs = nb_envs
+        self.min_action = -1.0
+        self.max_action = 1.0
+        self.min_position = -1.2
+        self.max_position = 0.6
+        self.max_speed = 0.07
+        self.goal_position = 0.45
+        self.power = 0.0015
+        self.action_bound = np.array([self.max_action])
+        self.position = np.zeros(nb_envs)
+        self.velocity = np.zeros(nb_envs)
+        self.pending_actions = None
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+
+    def _obs(self):
+        return np.stack([self.position, self.velocity], axis=1)
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.nb_envs, dtype=bool)
+        n = np.count_nonzero(mask)
+        self.position[mask] = self.np_random.uniform(-0.6, -0.4, n)
+        self.velocity[mask] = 0
+        return self._obs()
+
+    def step(self, actions):
+        force = np.clip(np.reshape(actions, (self.nb_envs, -1))[:, 0], self.min_action, self.max_action)
+
+        self.velocity += force * self.power - 0.0025 * np.cos(3 * self.position)
+        np.clip(self.velocity, -self.max_speed, self.max_speed, out=self.velocity)
+        self.position += self.velocity
+        np.clip(self.position, self.min_position, self.max_position, out=self.position)
+        self.velocity[(self.position == self.min_position) & (self.velocity < 0)] = 0
+
+        done = self.position >= self.goal_position
+        reward = 100.0 * done - np.square(force) * 0.1
+        return self._obs(), reward, done, {}
+
+    def step_async(self, actions):
+        # Stepping is cheap enough to be done when the results are asked for
+        self.pending_actions = actions
+
+    def step_wait(self):
+        return self.step(self.pending_actions)
+
+    def close(self):
+        pass